@@ -3,11 +3,26 @@ import sys
 import logging
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, render_template, request, jsonify, session, Response, send_from_directory
-from scraper import scrape_character_data, enhance_character_data
-from model_handler import RoleplayModel
+from scraper import load_character_profile
+from model_handler import RoleplayModel, ServerBusyError
 from emotion_detector import EmotionDetector
-from prompts import create_character_prompt
+from prompts import PromptBuilder
+from conversation_store import create_store
+from profile_cache import ProfileCache, read_catalog
+from inference_server import RemoteModel
+from summarizer import ConversationSummarizer
+from vector_index import MemoryRetriever
+from sse import ReplyStream, ReplyStreams, stored_reply_events
+from metrics import (
+    REGISTRY, EMOTION_SECONDS, PROMPT_BUILD_SECONDS, TIME_TO_FIRST_TOKEN, DECODE_RATE,
+    GENERATED_TOKENS, PROMPT_TOKENS, REQUEST_SECONDS, CHAT_REQUESTS, CHAT_REJECTED, CHAT_ERRORS
+)
+from config import (
+    CONVERSATION_STORE, STORE_PATH, SECRET_KEY_PATH, PROFILE_CACHE_DIR,
+    HISTORY_COMMIT_TOKENS, INFERENCE_SERVERS, MEMORY_INDEX_DIR, FEATURED_CHARACTERS
+)
 import requests
 
 # Get the absolute path to the current directory
@@ -23,37 +38,192 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def load_secret_key(path):
+    """Keep the session signing key across restarts so session IDs stay valid"""
+    if os.environ.get("FLASK_SECRET_KEY"):
+        return os.environ["FLASK_SECRET_KEY"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key = os.urandom(24)
+    try:
+        # O_EXCL: of several workers starting together, exactly one writes the key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # The creator may still be writing it
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                existing = f.read()
+            if existing:
+                return existing
+            time.sleep(0.01)
+        raise RuntimeError(f"Session key file is incomplete: {path}")
+    with open(fd, 'wb') as f:
+        f.write(key)
+    return key
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
-app.config['SESSION_TYPE'] = 'filesystem'
+app.secret_key = load_secret_key(os.path.join(BASE_DIR, SECRET_KEY_PATH))
+
+# Characters and chat history live server-side; the cookie only holds the session ID
+store = create_store(CONVERSATION_STORE, os.path.join(BASE_DIR, STORE_PATH))
+
+# Scraped and enhanced profiles, shared by every session loading the same URL
+profile_cache = ProfileCache(os.path.join(BASE_DIR, PROFILE_CACHE_DIR))
+
+# Lore and past turns retrieved into the prompt when relevant to the message
+retriever = MemoryRetriever(os.path.join(BASE_DIR, MEMORY_INDEX_DIR))
+
+# Streamed replies a dropped client can reconnect to
+streams = ReplyStreams()
+
+def get_session_id():
+    if 'sid' not in session:
+        session['sid'] = store.new_session()
+    return session['sid']
 
 # Build absolute path to models
-MODEL_PATH = os.path.join(BASE_DIR, "models", "pygmalion-2-7b")
+MODEL_PATH = os.environ.get("ROLEPLAY_MODEL_PATH", os.path.join(BASE_DIR, "models", "pygmalion-2-7b"))
 
 # Model status monitoring
 model_status = {
     "loaded": False,
     "loading": False,
     "last_inference_time": None,
-    "inference_count": 0,
-    "error": None
+    "last_prompt_tokens": None,
+    "error": None,
+    # Load state and duration of each startup stage
+    "stages": {
+        name: {"state": "pending", "seconds": None}
+        for name in ("tokenizer", "weights", "emotion")
+    }
 }
+model = None
+emotion_detector = None
+prompt_builder = None
+summarizer = None
+
+def run_stage(name, load):
+    """Run one startup stage, recording its state and load time"""
+    stage = model_status["stages"][name]
+    stage["state"] = "loading"
+    start_time = time.time()
+    try:
+        result = load()
+        stage["state"] = "ready"
+        return result
+    except Exception as e:
+        stage["state"] = "error"
+        stage["error"] = str(e)
+        raise
+    finally:
+        stage["seconds"] = round(time.time() - start_time, 3)
+        logger.info(f"Startup stage '{name}' finished in {stage['seconds']}s ({stage['state']})")
+
+def load_emotion_detector():
+    detector = EmotionDetector()
+    if detector.model is None:
+        raise RuntimeError("Emotion classifier unavailable, using neutral emotion")
+    return detector
+
+def load_local_model(pool):
+    roleplay_model = RoleplayModel(MODEL_PATH, load=False)
+    roleplay_model.backend.verify_files()
+    tokenizer_future = pool.submit(run_stage, "tokenizer", roleplay_model.backend.load_tokenizer)
+    weights_future = pool.submit(run_stage, "weights", roleplay_model.backend.load_weights)
+    tokenizer_future.result()
+    weights_future.result()
+    roleplay_model.backend.start()
+    return roleplay_model
+
+def connect_inference_servers():
+    # The weights stage waits for the shared inference processes instead
+    remote_model = RemoteModel(MODEL_PATH, [os.path.join(BASE_DIR, path) for path in INFERENCE_SERVERS])
+    run_stage("tokenizer", remote_model.load_tokenizer)
+    run_stage("weights", remote_model.wait_ready)
+    return remote_model
+
+def register_model_gauges(roleplay_model):
+    prefix_cache = getattr(roleplay_model, 'prefix_cache', None)
+    if prefix_cache is None:
+        return
+    REGISTRY.gauge("prefix_cache_entries", "Prompt prefixes held in the KV prefix cache",
+                   lambda: len(prefix_cache.entries))
+    REGISTRY.gauge("prefix_cache_bytes", "Memory used by the KV prefix cache",
+                   lambda: prefix_cache.size)
+    REGISTRY.callback_counter("prefix_cache_hits_total", "Prompts that reused a cached prefix",
+                              lambda: prefix_cache.hits)
+    REGISTRY.callback_counter("prefix_cache_misses_total", "Prompts prefilled from scratch",
+                              lambda: prefix_cache.misses)
+
+def record_generation(generation, start_time):
+    """Record per-request generation metrics once a reply is finished"""
+    timings = generation.timings()
+    if timings["ttft"] is not None:
+        TIME_TO_FIRST_TOKEN.observe(timings["ttft"])
+    if timings["decode_rate"] is not None:
+        DECODE_RATE.observe(timings["decode_rate"])
+    GENERATED_TOKENS.observe(timings["tokens"])
+    duration = time.time() - start_time
+    REQUEST_SECONDS.observe(duration)
+    CHAT_REQUESTS.inc()
+    model_status["last_inference_duration"] = duration
+
+def remember_turn(session_id, character, user_input, reply):
+    """Index a finished turn for recall and let the summarizer fold old ones"""
+    turn = {'user': user_input, 'bot': reply}
+    retriever.add_turn(session_id, turn, character.get('name', 'Character'))
+    summarizer.schedule(session_id)
+
+def warm_featured_characters(roleplay_model):
+    """Prefill the persona of every imported featured character before its first chat"""
+    path = os.path.join(BASE_DIR, FEATURED_CHARACTERS)
+    if not os.path.exists(path):
+        return
+    warmed = 0
+    for url in read_catalog(path):
+        entry = profile_cache.get(url)
+        if entry is None:
+            logger.warning(f"Featured character not imported yet: {url}")
+            continue
+        context, _ = prompt_builder.build_context(entry['profile'], "")
+        try:
+            warmed += roleplay_model.warm(context)
+        except Exception as e:
+            logger.error(f"Error warming {url}: {e}")
+    logger.info(f"Warmed {warmed} featured character prefixes")
 
 # Initialize models in background thread
 def init_models():
-    global model, emotion_detector, model_status
+    global model, emotion_detector, prompt_builder, summarizer, model_status
+    model_status["loading"] = True
+    # Tokenizer, memory-mapped weights and the emotion classifier load in
+    # parallel; chat opens as soon as the language model is ready and uses
+    # neutral emotion until the classifier catches up
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="loader")
+    emotion_future = pool.submit(run_stage, "emotion", load_emotion_detector)
     try:
-        model_status["loading"] = True
-        model = RoleplayModel(MODEL_PATH)
-        emotion_detector = EmotionDetector()
+        if INFERENCE_SERVERS:
+            roleplay_model = connect_inference_servers()
+        else:
+            roleplay_model = load_local_model(pool)
+        prompt_builder = PromptBuilder(roleplay_model.tokenizer)
+        summarizer = ConversationSummarizer(store, roleplay_model)
+        model = roleplay_model
+        register_model_gauges(roleplay_model)
         model_status["loaded"] = True
-        logger.info("Models loaded successfully")
+        logger.info("Language model ready")
+        warm_featured_characters(roleplay_model)
     except Exception as e:
         logger.error(f"Failed to initialize models: {e}")
         model_status["error"] = str(e)
     finally:
         model_status["loading"] = False
 
+    try:
+        emotion_detector = emotion_future.result()
+    except Exception as e:
+        logger.warning(f"Emotion detection disabled: {e}")
+    pool.shutdown(wait=False)
+
 # Start model loading in background
 model_loader = threading.Thread(target=init_models)
 model_loader.daemon = True
@@ -71,11 +241,9 @@ def send_static(path):
 def set_character():
     wiki_url = request.form['wiki_url']
     try:
-        character_data = scrape_character_data(wiki_url)
-        enhanced_data = enhance_character_data(character_data)
-        session['character'] = enhanced_data
-        session['chat_history'] = []
-        session['character_name'] = enhanced_data.get('name', 'Character')
+        enhanced_data = load_character_profile(wiki_url, profile_cache)
+        store.set_character(get_session_id(), enhanced_data)
+        retriever.forget(get_session_id())
         return jsonify(
             success=True, 
             name=enhanced_data.get('name', 'Character'),
@@ -86,63 +254,119 @@ def set_character():
         logger.error(f"Error setting character: {e}")
         return jsonify(success=False, error=str(e)), 400
 
-@app.route('/chat', methods=['POST'])
+def event_stream(events):
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Frames are already coalesced; proxy buffering would only add latency
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def resume_stream(last_event_id):
+    session_id = get_session_id()
+    stream, offset = streams.resume(last_event_id, session_id)
+    if stream is None:
+        # Owned by another worker (or long gone): follow the reply in the store
+        return event_stream(stored_reply_events(last_event_id, lambda: store.latest_reply(session_id)))
+    return event_stream(stream.events(offset))
+
+# GET serves the EventSource client, POST the plain JSON one
+@app.route('/chat', methods=['GET', 'POST'])
 def chat():
     if not model_status["loaded"]:
         return jsonify(response="AI model still loading", error=True)
     
-    user_input = request.form['message']
-    character = session.get('character', {})
-    history = session.get('chat_history', [])
+    # A dropped EventSource reconnects with the ID of the last frame it got
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id and request.headers.get('Accept') == 'text/event-stream':
+        return resume_stream(last_event_id)
+    
+    user_input = request.values.get('message', '')
+    start_time = time.time()
+    session_id = get_session_id()
+    character = store.get_character(session_id)
+    history = store.get_history(session_id)
+    summary = store.get_summary(session_id)
     
-    # Detect emotion
-    emotion = emotion_detector.detect_emotion(user_input) if emotion_detector else "neutral"
+    # Start emotion detection; the prompt context is built while it runs
+    emotion_future = emotion_detector.detect_emotion_async(user_input) if emotion_detector else None
     
-    # Format conversation history
-    history_text = "\n".join(
-        [f"User: {msg['user']}\n{character.get('name', 'Character')}: {msg['bot']}" 
-         for msg in history[-10:]]
-    )
+    # Build persona and history within the token budget (segmented so prefixes
+    # can be cached) and prefill them while the classifier is still running
+    build_start = time.perf_counter()
+    in_prompt = [retriever.turn_text(turn, character.get('name', 'Character')) for turn in history]
+    memory = retriever.retrieve(character, session_id, user_input, exclude=in_prompt)
+    context, prompt_stats = prompt_builder.build_context(character, user_input, history, summary, memory)
+    PROMPT_BUILD_SECONDS.observe(time.perf_counter() - build_start)
+    model.prefill(context)
     
-    # Generate prompt
-    prompt = create_character_prompt(character, user_input, emotion, history_text)
+    emotion = "neutral"
+    if emotion_future is not None:
+        emotion_start = time.perf_counter()
+        try:
+            emotion = emotion_future.result(timeout=10)
+        except Exception as e:
+            logger.error(f"Emotion detection failed: {e}")
+        EMOTION_SECONDS.observe(time.perf_counter() - emotion_start)
+    prompt, prompt_stats = prompt_builder.add_user_turn(context, prompt_stats, user_input, emotion)
     
     # Update status
     model_status["last_inference_time"] = time.time()
+    model_status["last_prompt_tokens"] = prompt_stats["prompt_tokens"]
+    PROMPT_TOKENS.observe(prompt_stats["prompt_tokens"])
     
     # Get AI response
     try:
         # For streaming
         if request.headers.get('Accept') == 'text/event-stream':
-            def generate():
-                full_response = ""
-                start_time = time.time()
-                for token in model.stream_response(prompt):
-                    full_response += token
-                    yield f"data: {token}\n\n"
-                # Update history after completion
-                history.append({'user': user_input, 'bot': full_response})
-                session['chat_history'] = history[-15:]
-                model_status["inference_count"] += 1
-                model_status["last_inference_duration"] = time.time() - start_time
-            return Response(generate(), mimetype='text/event-stream')
+            generation = model.submit(prompt)
+            turn = store.begin_turn(session_id, user_input)
+            committed = {"text": 0, "tokens": 0}
+            
+            def commit_chunk():
+                # Append only what was generated since the last commit
+                if len(generation.generated_ids) - committed["tokens"] < HISTORY_COMMIT_TOKENS:
+                    return
+                ids = generation.generated_ids[committed["tokens"]:]
+                text = generation.text[committed["text"]:]
+                if text:
+                    store.append_reply(session_id, turn, text, ids)
+                    committed["text"] += len(text)
+                    committed["tokens"] += len(ids)
+            
+            def finalize():
+                # Runs once the reply is complete, or abandoned by its client
+                store.finish_turn(session_id, turn, generation.text, generation.generated_ids)
+                remember_turn(session_id, character, user_input, generation.text)
+                record_generation(generation, start_time)
+            
+            stream = streams.add(ReplyStream(session_id, generation, finalize, commit_chunk))
+            return event_stream(stream.events())
         
         # For regular response
-        start_time = time.time()
-        full_response = model.generate_response(prompt)
-        history.append({'user': user_input, 'bot': full_response})
-        session['chat_history'] = history[-15:]
-        model_status["inference_count"] += 1
-        model_status["last_inference_duration"] = time.time() - start_time
-        return jsonify(response=full_response)
+        generation = model.submit(prompt)
+        full_response = generation.result().strip()
+        # Stored unstripped, so the text is what the stored token IDs decode to
+        store.append_turn(session_id, user_input, generation.text, generation.generated_ids)
+        remember_turn(session_id, character, user_input, full_response)
+        record_generation(generation, start_time)
+        return jsonify(response=full_response, prompt_tokens=prompt_stats["prompt_tokens"])
     
+    except ServerBusyError as e:
+        CHAT_REJECTED.inc()
+        logger.warning(f"Rejecting chat request: {e}")
+        response = jsonify(response="The server is busy. Please try again in a moment.", error=True)
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
     except Exception as e:
+        CHAT_ERRORS.inc()
         logger.error(f"Error generating response: {e}")
         return jsonify(response="I encountered an error. Please try again.", error=True)
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
-    session['chat_history'] = []
+    store.clear_history(get_session_id())
+    retriever.forget(get_session_id())
     return jsonify(success=True)
 
 @app.route('/status')
@@ -151,10 +375,19 @@ def status():
         "model_loaded": model_status["loaded"],
         "model_loading": model_status["loading"],
         "last_inference_time": model_status.get("last_inference_time"),
-        "inference_count": model_status["inference_count"],
+        "inference_count": CHAT_REQUESTS.value,
         "last_inference_duration": model_status.get("last_inference_duration"),
+        "last_prompt_tokens": model_status.get("last_prompt_tokens"),
+        "emotion_ready": emotion_detector is not None,
+        "stages": model_status["stages"],
+        # Counters, cache gauges and p50/p99 of every pipeline stage
+        "metrics": REGISTRY.summary(),
         "error": model_status.get("error")
     })
 
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
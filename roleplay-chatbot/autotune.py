@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import torch
+from datetime import datetime, timezone
+from model_handler import BACKENDS, BatchScheduler
+from host_profile import allowed_cpus, physical_cores, core_order, pin_process, save_profile
+from config import INFERENCE_BACKEND, MAX_BATCH_SIZE, DECODE_MODE
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("ROLEPLAY_MODEL_PATH", os.path.join(BASE_DIR, "models", "pygmalion-2-7b"))
+MIN_STREAM_RATE = 5.0  # Tokens/second each reply must keep up, or reading it feels stalled
+
+
+def thread_candidates(cpus):
+    """Powers of two below the CPU count, plus the physical core and CPU counts"""
+    counts = {len(cpus), len(physical_cores(cpus))}
+    count = 1
+    while count < len(cpus):
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def synthetic_prompts(tokenizer, count, length):
+    """Distinct random prompts, so no run is served from a cache"""
+    vocab = [token_id for token_id in range(tokenizer.vocab_size) if token_id not in tokenizer.all_special_ids]
+    return [[tokenizer.bos_token_id or vocab[0]] + random.sample(vocab, length - 1) for _ in range(count)]
+
+
+def run_workload(backend, tokenizer, batch_size, prompt_tokens, new_tokens):
+    """Prefill and decode batch_size prompts at once; returns throughput figures"""
+    backend.scheduler.max_batch_size = batch_size
+    prompts = synthetic_prompts(tokenizer, batch_size, prompt_tokens)
+    start_time = time.monotonic()
+    requests = [backend.submit(prompt, new_tokens) for prompt in prompts]
+    for request in requests:
+        request.result()
+    elapsed = time.monotonic() - start_time
+    timings = [request.timings() for request in requests]
+    rates = [t["decode_rate"] for t in timings if t["decode_rate"]]
+    ttfts = [t["ttft"] for t in timings if t["ttft"] is not None]
+    return {
+        "tokens_per_sec": round(sum(t["tokens"] for t in timings) / elapsed, 2),
+        "decode_rate": round(min(rates), 2) if rates else 0.0,
+        "ttft": round(max(ttfts), 3) if ttfts else None,
+    }
+
+
+def tune(backend, threads_options, batch_options, pin_options, prompt_tokens, new_tokens):
+    """Benchmark every combination; returns one result dict per run"""
+    cpus = allowed_cpus()
+    ordered = core_order(cpus)
+    results = []
+    for pin in pin_options:
+        for threads in threads_options:
+            # Pinned runs use one CPU per physical core before any SMT sibling
+            pin_process(ordered[:threads] if pin else cpus)
+            torch.set_num_threads(threads)
+            # Warm-up, so allocator growth and one-time kernel setup are not timed
+            run_workload(backend, backend.tokenizer, 1, prompt_tokens, 2)
+            for batch_size in batch_options:
+                result = run_workload(backend, backend.tokenizer, batch_size, prompt_tokens, new_tokens)
+                result.update(threads=threads, pin=pin, max_batch_size=batch_size)
+                results.append(result)
+                print(
+                    f"threads={threads:<3} pin={'yes' if pin else 'no ':<3} batch={batch_size:<3} "
+                    f"{result['tokens_per_sec']:8.1f} tok/s  per-reply {result['decode_rate']:6.1f} tok/s  "
+                    f"ttft {result['ttft']}s"
+                )
+    pin_process(cpus)
+    return results
+
+
+def best_result(results, min_rate):
+    """Highest throughput among runs where every reply still streams at min_rate"""
+    usable = [result for result in results if result["decode_rate"] >= min_rate] or results
+    return max(usable, key=lambda result: result["tokens_per_sec"])
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark CPU threading, pinning and batch size on this host and save the best profile"
+    )
+    parser.add_argument("--model", default=MODEL_PATH, help="Model directory; the profile is saved there")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=["transformers", "int8"])
+    parser.add_argument("--threads", type=_int_list, default=None,
+                        help="Comma-separated thread counts (default: powers of two, cores and CPUs)")
+    parser.add_argument("--batch", type=_int_list, default=sorted({1, 2, 4, 8, 16, MAX_BATCH_SIZE}),
+                        help="Comma-separated max batch sizes")
+    parser.add_argument("--no-pin", action="store_true", help="Only try unpinned runs")
+    parser.add_argument("--prompt-tokens", type=int, default=256, help="Synthetic prompt length")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens decoded per reply")
+    parser.add_argument("--min-rate", type=float, default=MIN_STREAM_RATE,
+                        help="Slowest acceptable per-reply decode rate (tokens/second)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if torch.cuda.is_available():
+        print("A GPU is available; CPU tuning would not apply to it")
+        return 1
+
+    # The app's other threads (request handlers, the emotion pipeline) share
+    # these cores, so torch gets one inter-op thread rather than its default pool
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    backend = BACKENDS[args.backend](args.model, "cpu")
+    backend.load()
+    batch_options = args.batch
+    if not isinstance(backend.scheduler, BatchScheduler):
+        # The other decode modes serve one request at a time
+        print(f"DECODE_MODE {DECODE_MODE!r} does not batch; tuning threads and pinning only")
+        batch_options = [1]
+
+    cpus = allowed_cpus()
+    threads_options = [t for t in (args.threads or thread_candidates(cpus)) if 0 < t <= len(cpus)]
+    pin_options = [False] if args.no_pin or not hasattr(os, "sched_setaffinity") else [False, True]
+    results = tune(backend, threads_options, batch_options, pin_options, args.prompt_tokens, args.tokens)
+    best = best_result(results, args.min_rate)
+
+    profile = {
+        "threads": best["threads"],
+        "interop_threads": 1,
+        "cpus": core_order(cpus)[:best["threads"]] if best["pin"] else None,
+        "max_batch_size": best["max_batch_size"],
+        "decode_mode": DECODE_MODE,
+        "tokens_per_sec": best["tokens_per_sec"],
+        "decode_rate": best["decode_rate"],
+        "torch": torch.__version__,
+        "tuned_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "results": results,
+    }
+    path = save_profile(args.model, args.backend, profile)
+    print(
+        f"Best: {best['threads']} threads, {'pinned' if best['pin'] else 'unpinned'}, "
+        f"batch {best['max_batch_size']} ({best['tokens_per_sec']} tok/s); saved to {path}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""Load test and benchmark for the chat pipeline.
+
+Runs on CPU against a tiny randomly initialised model and a saved set of wiki
+pages served from localhost, so results only depend on this code and the
+machine. Reports time to first token, decode tokens/sec, p50/p99 latencies
+and peak RSS for each stage:
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --concurrency 8 --turns 4 --only model,app --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fixture_server import FixtureServer, ModelFileServer  # noqa: E402
+
+SECTIONS = ("prompts", "emotion", "model", "backends", "scraper", "app", "download")
+FIXTURE_PAGES = ("naruto", "sherlock", "stub")
+
+NAMES = ["Aria", "Brock", "Celeste", "Dorian", "Elena", "Fenwick", "Greta", "Hiro"]
+TRAITS = ["brave", "sarcastic", "gentle", "curious", "stubborn", "cheerful", "secretive", "loyal"]
+MESSAGES = [
+    "Hello there! How are you today?",
+    "What do you think about the village elders?",
+    "I lost my sword in the river, can you help me?",
+    "Tell me about the last adventure you had.",
+    "Why are you always so serious?",
+    "I'm scared of what is waiting for us in the forest.",
+    "That was amazing, let's do it again!",
+    "Do you ever miss your home?"
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(values, scale=1.0):
+    """n, p50, p99 and mean of a list of samples (scaled, e.g. seconds to ms)"""
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "p50": round(percentile(values, 0.5) * scale, 3),
+        "p99": round(percentile(values, 0.99) * scale, 3),
+        "mean": round(sum(values) / len(values) * scale, 3)
+    }
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def synthetic_character(rng):
+    name = rng.choice(NAMES)
+    traits = rng.sample(TRAITS, 3)
+    return {
+        'name': name,
+        'description': f"{name} is a wandering hero. " * rng.randint(5, 40),
+        'personality': f"{name} is {', '.join(traits)}. " * rng.randint(5, 40),
+        'speech_style': f"- I am {name}, and I never give up!\n" * rng.randint(1, 5),
+        'image_url': '',
+        'source_url': f"https://example.org/wiki/{name}"
+    }
+
+
+def run_concurrently(concurrency, work):
+    """Call work(worker_index) on `concurrency` threads and return wall time"""
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(work, i) for i in range(concurrency)]:
+            future.result()
+    return time.perf_counter() - start_time
+
+
+def bench_prompts(args, env):
+    from prompts import create_character_prompt, PromptBuilder
+    from transformers import AutoTokenizer
+    rng = random.Random(args.seed)
+    builder = PromptBuilder(AutoTokenizer.from_pretrained(env["model_path"], local_files_only=True))
+    legacy, budgeted = [], []
+    for i in range(args.iterations):
+        character = synthetic_character(rng)
+        history = [{'user': rng.choice(MESSAGES), 'bot': rng.choice(MESSAGES), 'bot_tokens': []}
+                   for _ in range(rng.randint(0, 15))]
+        message = rng.choice(MESSAGES)
+        history_text = "\n".join(f"User: {turn['user']}\n{character['name']}: {turn['bot']}" for turn in history)
+
+        start_time = time.perf_counter()
+        create_character_prompt(character, message, "joy", history_text)
+        legacy.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        builder.build(character, message, "joy", history)
+        budgeted.append(time.perf_counter() - start_time)
+    return {
+        "create_character_prompt_ms": summarize(legacy, 1000),
+        "prompt_builder_ms": summarize(budgeted, 1000)
+    }
+
+
+def bench_emotion(args, env):
+    import emotion_detector
+    emotion_detector.EMOTION_MODEL = env["classifier_path"]
+    detector = emotion_detector.EmotionDetector()
+    if detector.model is None:
+        return {"error": "emotion classifier failed to load"}
+    rng = random.Random(args.seed)
+    latencies = []
+    lock = threading.Lock()
+
+    def work(worker):
+        for i in range(args.iterations):
+            # Unique text so the label cache does not hide the classifier
+            text = f"{rng.choice(MESSAGES)} ({worker}-{i})"
+            start_time = time.perf_counter()
+            detector.detect_emotion(text)
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+
+    wall = run_concurrently(args.concurrency, work)
+    return {
+        "latency_ms": summarize(latencies, 1000),
+        "messages_per_sec": round(len(latencies) / wall, 1)
+    }
+
+
+def bench_model(args, env):
+    from model_handler import RoleplayModel
+    from prompts import PromptBuilder
+    model = RoleplayModel(env["model_path"])
+    builder = PromptBuilder(model.tokenizer)
+    rng = random.Random(args.seed)
+    characters = [synthetic_character(rng) for _ in range(args.concurrency)]
+    ttft, rates, latencies, tokens = [], [], [], []
+    lock = threading.Lock()
+
+    def work(worker):
+        character = characters[worker]
+        history = []
+        for turn in range(args.turns):
+            message = MESSAGES[(worker + turn) % len(MESSAGES)]
+            prompt, _ = builder.build(character, message, "neutral", history)
+            start_time = time.perf_counter()
+            first_token = None
+            request = model.submit(prompt, args.max_tokens)
+            for chunk in model.stream(request):
+                if first_token is None:
+                    first_token = time.perf_counter()
+            end_time = time.perf_counter()
+            with lock:
+                latencies.append(end_time - start_time)
+                tokens.append(len(request.generated_ids))
+                if first_token is not None:
+                    ttft.append(first_token - start_time)
+                    if len(request.generated_ids) > 1 and end_time > first_token:
+                        rates.append((len(request.generated_ids) - 1) / (end_time - first_token))
+            history.append({'user': message, 'bot': request.text, 'bot_tokens': request.generated_ids})
+
+    wall = run_concurrently(args.concurrency, work)
+    results = {
+        "ttft_ms": summarize(ttft, 1000),
+        "decode_tokens_per_sec": summarize(rates),
+        "latency_ms": summarize(latencies, 1000),
+        "generated_tokens": summarize(tokens),
+        "aggregate_tokens_per_sec": round(sum(tokens) / wall, 1)
+    }
+    if model.prefix_cache is not None:
+        results["prefix_cache"] = model.prefix_cache.stats()
+    return results
+
+
+def bench_backends(args, env):
+    """Greedy parity of the int8 backend with the float32 transformers one"""
+    import torch
+    from model_handler import BACKENDS
+    from prompts import PromptBuilder
+    models = {}
+    for name in ("transformers", "int8"):
+        backend = BACKENDS[name](env["model_path"], "cpu")
+        backend.load_tokenizer()
+        backend.load_weights()
+        models[name] = backend
+    tokenizer = models["transformers"].tokenizer
+    builder = PromptBuilder(tokenizer)
+    rng = random.Random(args.seed)
+    matching, exact, agree, positions = [], 0, 0, 0
+    for i, message in enumerate(MESSAGES):
+        prompt, _ = builder.build(synthetic_character(rng), message, "neutral", [])
+        input_ids = torch.tensor([tokenizer("".join(prompt))["input_ids"]])
+        with torch.no_grad():
+            outputs = {
+                name: backend.model.generate(
+                    input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                    max_new_tokens=args.max_tokens, pad_token_id=tokenizer.pad_token_id
+                )[0, input_ids.shape[1]:].tolist()
+                for name, backend in models.items()
+            }
+            # Next-token agreement along the reference reply, so one early
+            # divergence does not hide how close the rest is
+            reference = torch.tensor([input_ids[0].tolist() + outputs["transformers"]])
+            picks = [
+                backend.model(reference).logits[0, input_ids.shape[1] - 1:-1].argmax(-1)
+                for backend in models.values()
+            ]
+        a, b = outputs["transformers"], outputs["int8"]
+        prefix = next((j for j, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+        matching.append(prefix)
+        exact += a == b
+        agree += int((picks[0] == picks[1]).sum())
+        positions += len(picks[0])
+    return {
+        "greedy_exact_match": f"{exact}/{len(MESSAGES)}",
+        "greedy_matching_prefix_tokens": summarize(matching),
+        "next_token_agreement": round(agree / positions, 4) if positions else None
+    }
+
+
+def bench_scraper(args, env):
+    from scraper import load_character_profile
+    from profile_cache import ProfileCache
+    fixtures = env["fixtures"]
+    urls = [fixtures.url(page) for page in FIXTURE_PAGES]
+    results = {}
+    cache = ProfileCache(tempfile.mkdtemp(dir=env["workdir"]), ttl=3600)
+    for label in ("cold", "warm"):
+        latencies = []
+        for url in urls:
+            start_time = time.perf_counter()
+            load_character_profile(url, cache)
+            latencies.append(time.perf_counter() - start_time)
+        results[f"{label}_ms"] = summarize(latencies, 1000)
+    # Stale entries are revalidated with If-None-Match and answered with 304
+    cache.ttl = 0
+    latencies = []
+    for url in urls:
+        start_time = time.perf_counter()
+        load_character_profile(url, cache)
+        latencies.append(time.perf_counter() - start_time)
+    results["revalidate_ms"] = summarize(latencies, 1000)
+    return results
+
+
+def bench_download(args, env):
+    from download_model import download_model
+    from model_manifest import load_manifest, check_manifest, verify_manifest
+    target = tempfile.mkdtemp(dir=env["workdir"])
+    weights = [name for name in os.listdir(env["model_path"]) if name.endswith(".safetensors")]
+    # Every weights file is cut off half way on its first request, then resumed
+    with ModelFileServer(env["model_path"], flaky=weights) as server:
+        start_time = time.perf_counter()
+        download_model(server.repo_id, target, endpoint=server.base_url)
+        download_seconds = time.perf_counter() - start_time
+        resumed = server.range_requests
+    manifest = load_manifest(target)
+    start_time = time.perf_counter()
+    check_problems = check_manifest(target, manifest)
+    check_ms = (time.perf_counter() - start_time) * 1000
+    start_time = time.perf_counter()
+    verify_problems = verify_manifest(target, manifest)
+    verify_seconds = time.perf_counter() - start_time
+    return {
+        "download_seconds": round(download_seconds, 3),
+        "resumed_requests": resumed,
+        "files": len(manifest["files"]),
+        "startup_check_ms": round(check_ms, 3),
+        "full_verify_seconds": round(verify_seconds, 3),
+        "problems": len(check_problems) + len(verify_problems)
+    }
+
+
+def bench_app(args, env):
+    import app as chat_app
+    deadline = time.monotonic() + 300
+    while not (chat_app.model_status["loaded"] or chat_app.model_status["error"]):
+        if time.monotonic() > deadline:
+            return {"error": "model did not load"}
+        time.sleep(0.1)
+    if chat_app.model_status["error"]:
+        return {"error": chat_app.model_status["error"]}
+
+    fixtures = env["fixtures"]
+    set_character, ttft, latencies, events = [], [], [], []
+    lock = threading.Lock()
+
+    def work(worker):
+        client = chat_app.app.test_client()
+        url = fixtures.url(FIXTURE_PAGES[worker % len(FIXTURE_PAGES)])
+        start_time = time.perf_counter()
+        response = client.post('/set_character', data={'wiki_url': url})
+        with lock:
+            set_character.append(time.perf_counter() - start_time)
+        if response.status_code != 200:
+            return
+        for turn in range(args.turns):
+            message = MESSAGES[(worker + turn) % len(MESSAGES)]
+            start_time = time.perf_counter()
+            first_token = None
+            count = 0
+            response = client.get('/chat', query_string={'message': message},
+                                  headers={'Accept': 'text/event-stream'}, buffered=False)
+            for chunk in response.response:
+                # Reply frames carry an event ID; keep-alives and "done" do not
+                if chunk.startswith(b"id:") if isinstance(chunk, bytes) else chunk.startswith("id:"):
+                    count += 1
+                    if first_token is None:
+                        first_token = time.perf_counter()
+            response.close()
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+                events.append(count)
+                if first_token is not None:
+                    ttft.append(first_token - start_time)
+
+    wall = run_concurrently(args.concurrency, work)
+    return {
+        "set_character_ms": summarize(set_character, 1000),
+        "chat_ttft_ms": summarize(ttft, 1000),
+        "chat_latency_ms": summarize(latencies, 1000),
+        "chat_turns_per_sec": round(len(latencies) / wall, 2),
+        "stream_events_per_sec": round(sum(events) / wall, 1)
+    }
+
+
+def print_report(results):
+    for section, metrics in results.items():
+        print(f"\n[{section}]")
+        for name, value in metrics.items():
+            if isinstance(value, dict) and "n" in value:
+                stats = "  ".join(f"{key}={value[key]}" for key in ("n", "p50", "p99", "mean") if key in value)
+                print(f"  {name:<28} {stats}")
+            else:
+                print(f"  {name:<28} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipeline with a tiny local model")
+    parser.add_argument("--concurrency", type=int, default=4, help="Simultaneous users")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per user")
+    parser.add_argument("--iterations", type=int, default=50, help="Samples per user for prompt/emotion benchmarks")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Reply length for model benchmarks")
+    parser.add_argument("--only", default=",".join(SECTIONS), help=f"Comma-separated subset of {','.join(SECTIONS)}")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "roleplay-bench"),
+                        help="Where the tiny models and caches are kept between runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args()
+
+    sections = [section.strip() for section in args.only.split(",") if section.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    from tiny_model import make_tiny_model, make_tiny_classifier
+    os.makedirs(args.workdir, exist_ok=True)
+    model_path = make_tiny_model(os.path.join(args.workdir, "tiny-lm"))
+    classifier_path = make_tiny_classifier(os.path.join(args.workdir, "tiny-emotion"))
+
+    # Must be set before the app and its modules are imported
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("FLASK_SECRET_KEY", "benchmark")
+    os.environ["ROLEPLAY_MODEL_PATH"] = model_path
+    import config
+    config.CONVERSATION_STORE = "memory"
+    config.PROFILE_CACHE_DIR = tempfile.mkdtemp(dir=args.workdir)
+    config.MEMORY_INDEX_DIR = tempfile.mkdtemp(dir=args.workdir)
+    import emotion_detector
+    emotion_detector.EMOTION_MODEL = classifier_path
+
+    import torch
+    torch.manual_seed(args.seed)
+
+    with FixtureServer() as fixtures:
+        import scraper
+        scraper.WIKIPEDIA_API = f"{fixtures.base_url}/w/api.php"
+        scraper.QUOTES_API = f"{fixtures.base_url}/api/search"
+        scraper.CHARACTER_WIKI = fixtures.base_url
+        logging.disable(logging.WARNING)
+
+        env = {
+            "model_path": model_path,
+            "classifier_path": classifier_path,
+            "fixtures": fixtures,
+            "workdir": args.workdir
+        }
+        runners = {
+            "prompts": bench_prompts,
+            "emotion": bench_emotion,
+            "model": bench_model,
+            "backends": bench_backends,
+            "scraper": bench_scraper,
+            "app": bench_app,
+            "download": bench_download
+        }
+        results = {}
+        for section in sections:
+            start_time = time.perf_counter()
+            results[section] = runners[section](args, env)
+            results[section]["seconds"] = round(time.perf_counter() - start_time, 2)
+            results[section]["peak_rss_mb"] = peak_rss_mb()
+
+    results["settings"] = {
+        "concurrency": args.concurrency,
+        "turns": args.turns,
+        "iterations": args.iterations,
+        "max_tokens": args.max_tokens,
+        "seed": args.seed,
+        "torch_threads": torch.get_num_threads()
+    }
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
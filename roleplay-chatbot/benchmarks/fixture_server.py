@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Request paths of the wiki and enrichment endpoints mapped to fixture files
+ROUTES = {
+    "/w/api.php": ("wikipedia.json", "application/json"),
+    "/api/search": ("quotes.json", "application/json"),
+    "/wiki/Special:Search": ("search.html", "text/html; charset=utf-8")
+}
+
+
+class FixtureServer:
+    """Serves saved wiki pages and enrichment responses on localhost.
+
+    /wiki/<name> returns fixtures/<name>.html. Responses carry an ETag and
+    answer If-None-Match with 304, like the real wikis. "{base}" inside a
+    fixture is replaced with the server's own URL so links stay local.
+    """
+
+    def __init__(self, directory=FIXTURES_DIR, port=0):
+        self.directory = directory
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                body, content_type = server.resolve(urlsplit(self.path).path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def resolve(self, path):
+        if path in ROUTES:
+            filename, content_type = ROUTES[path]
+        elif path.startswith("/wiki/"):
+            filename, content_type = path[len("/wiki/"):] + ".html", "text/html; charset=utf-8"
+        else:
+            return None, None
+        file_path = os.path.join(self.directory, os.path.basename(filename))
+        if not os.path.exists(file_path):
+            return None, None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read().replace("{base}", self.base_url).encode('utf-8'), content_type
+
+    def url(self, name):
+        return f"{self.base_url}/wiki/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ModelFileServer:
+    """Serves a local model directory the way the Hugging Face Hub does.
+
+    /api/models/<repo>/revision/<rev> lists the files (weights with an LFS
+    sha256) and /<repo>/resolve/<rev>/<file> serves them, honouring Range
+    requests. The first response for each file in `flaky` is cut off after
+    the `drop_at` fraction of its bytes, as on a bad link.
+    """
+
+    def __init__(self, directory, repo_id="local/model", flaky=(), drop_at=0.5):
+        self.directory = directory
+        self.repo_id = repo_id
+        self.drop_at = drop_at
+        self.flaky = set(flaky)
+        self.range_requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path.startswith(f"/api/models/{server.repo_id}/revision/"):
+                    body = json.dumps(server.listing()).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                prefix = f"/{server.repo_id}/resolve/"
+                name = path[len(prefix):].partition('/')[2] if path.startswith(prefix) else ""
+                file_path = os.path.join(server.directory, name)
+                if not name or not os.path.isfile(file_path):
+                    self.send_error(404)
+                    return
+                size = os.path.getsize(file_path)
+                start = 0
+                match = re.match(r"bytes=(\d+)-$", self.headers.get('Range', ''))
+                if match:
+                    server.range_requests += 1
+                    start = int(match.group(1))
+                    if start >= size:
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(size - start))
+                self.end_headers()
+                with open(file_path, 'rb') as f:
+                    f.seek(start)
+                    body = f.read()
+                if name in server.flaky:
+                    server.flaky.discard(name)
+                    self.wfile.write(body[:int(len(body) * server.drop_at)])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def listing(self):
+        siblings = []
+        for name in sorted(os.listdir(self.directory)):
+            file_path = os.path.join(self.directory, name)
+            if not os.path.isfile(file_path):
+                continue
+            sibling = {"rfilename": name, "size": os.path.getsize(file_path)}
+            if name.endswith((".safetensors", ".bin")):
+                with open(file_path, 'rb') as f:
+                    sibling["lfs"] = {"sha256": hashlib.sha256(f.read()).hexdigest(), "size": sibling["size"]}
+            siblings.append(sibling)
+        return {"id": self.repo_id, "sha": "0" * 40, "siblings": siblings}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
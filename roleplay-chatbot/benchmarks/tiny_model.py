@@ -0,0 +1,109 @@
+import io
+import os
+import glob
+import torch
+from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+from transformers import (
+    PreTrainedTokenizerFast, LlamaTokenizer, LlamaConfig, LlamaForCausalLM, LlamaForSequenceClassification
+)
+from fixture_server import FIXTURES_DIR
+
+SPECIAL_TOKENS = ["<unk>", "<s>", "</s>", "<pad>", "<|system|>", "<|user|>", "<|model|>"]
+EMOTIONS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+
+
+def _training_text():
+    """Fixture pages plus the prompt template, so tokenization looks realistic"""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    texts.append("<|system|>You are Naruto. Stay in character at all times.\nBackground: \n"
+                 "Personality: \nSpeech Style: </s>\n<|system|>User's emotion: joy</s>\n"
+                 "<|user|>Hello there!</s>\n<|model|>")
+    return texts
+
+
+def build_tokenizer(vocab_size=2000):
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=SPECIAL_TOKENS,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(_training_text(), trainer)
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>", pad_token="<pad>"
+    )
+
+
+def build_sentencepiece_tokenizer(vocab_size=600):
+    """Llama-style tokenizer: SentencePiece BPE with word-start markers and byte fallback.
+
+    The byte-level tokenizer above marks no word starts, so it cannot show
+    where tokenizing a prompt piece by piece differs from tokenizing it whole.
+    """
+    import sentencepiece as spm
+    model = io.BytesIO()
+    lines = [line for text in _training_text() for line in text.split("\n") if line.strip()]
+    spm.SentencePieceTrainer.train(
+        sentence_iterator=iter(lines), model_writer=model, vocab_size=vocab_size, model_type="bpe",
+        byte_fallback=True, character_coverage=1.0, unk_id=0, bos_id=1, eos_id=2, pad_id=-1, minloglevel=2
+    )
+    processor = spm.SentencePieceProcessor(model_proto=model.getvalue())
+    vocab = {processor.id_to_piece(i): i for i in range(processor.get_piece_size())}
+    # Merges ranked by the merged piece, as transformers converts Llama's tokenizer.model
+    merges = sorted(
+        ((piece[:i], piece[i:]) for piece in vocab for i in range(1, len(piece))
+         if piece[:i] in vocab and piece[i:] in vocab),
+        key=lambda pair: (vocab[pair[0] + pair[1]], vocab[pair[0]], vocab[pair[1]])
+    )
+    return LlamaTokenizer(vocab=vocab, merges=merges, add_bos_token=True)
+
+
+def _config(tokenizer, **kwargs):
+    return LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=128,
+        intermediate_size=256,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        **kwargs
+    )
+
+
+def make_tiny_model(path, seed=0):
+    """Randomly initialised causal LM laid out like the real model directory"""
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    tokenizer = build_tokenizer()
+    tokenizer.save_pretrained(path)
+    # The transformers backend checks for the sentencepiece file of the real model
+    open(os.path.join(path, "tokenizer.model"), "wb").close()
+    torch.manual_seed(seed)
+    LlamaForCausalLM(_config(tokenizer)).save_pretrained(path)
+    return path
+
+
+def make_tiny_classifier(path, seed=0):
+    """Randomly initialised emotion classifier with the real model's labels"""
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    tokenizer = build_tokenizer()
+    tokenizer.save_pretrained(path)
+    torch.manual_seed(seed)
+    config = _config(
+        tokenizer,
+        num_labels=len(EMOTIONS),
+        id2label=dict(enumerate(EMOTIONS)),
+        label2id={label: i for i, label in enumerate(EMOTIONS)}
+    )
+    LlamaForSequenceClassification(config).save_pretrained(path)
+    return path
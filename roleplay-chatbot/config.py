@@ -2,10 +2,88 @@
 MODEL_PATH = "./models/pygmalion-2-7b"
 MAX_RESPONSE_LENGTH = 250
 HISTORY_LENGTH = 15  # Number of exchanges to remember
+CONTEXT_TOKENS = 4096  # Model context window shared by prompt and reply
+
+# Inference backend: "transformers" (4-bit on CUDA, float32 on CPU),
+# "int8" (dynamically quantized CPU model) or "gguf" (llama.cpp)
+INFERENCE_BACKEND = "transformers"
+GGUF_FILE = "pygmalion-2-7b.Q4_K_M.gguf"  # Looked up inside the model directory
+
+# Model files: download_model.py writes manifest.json (sizes and sha256 of
+# every file) into the model directory; startup checks sizes against it and
+# `python validate_model.py --full` re-hashes every file
+MODEL_REPO = "PygmalionAI/pygmalion-2-7b"
+MODEL_ENDPOINT = "https://huggingface.co"  # HF_ENDPOINT overrides, e.g. a local mirror
+DOWNLOAD_WORKERS = 4  # Files downloaded at once
+DOWNLOAD_RETRIES = 5  # Resumed attempts per file after a dropped connection
+MANIFEST_HASH_WORKERS = 4  # Files hashed at once when verifying
+
+# Decoding: "batched" (continuous batching across sessions), "speculative"
+# (one request at a time, drafted by SPECULATIVE_DRAFT_MODEL if set, otherwise
+# by n-gram lookup in the prompt) or "compiled" (one request at a time with a
+# static KV cache and a torch.compile'd decode step; needs a C++ compiler on CPU)
+DECODE_MODE = "batched"
+SPECULATIVE_DRAFT_MODEL = None  # Path to a small model sharing the main model's tokenizer
+PROMPT_LOOKUP_TOKENS = 10  # Tokens drafted per step by prompt lookup
+COMPILE_CACHE_DIR = "data/compile_cache"  # Compiled kernels, reused by later starts
+
+# Replies end at the first of these, so the model does not go on to write the
+# user's next line; the stop text itself is never shown or stored
+STOP_SEQUENCES = ["<|user|>", "<|system|>", "User:"]
 
 # Performance settings
 ENABLE_STREAMING = True
 EMOTION_DETECTION = True
+EMOTION_RUNTIME = "pytorch"  # "pytorch", "int8" (quantized) or "onnx" (needs optimum[onnxruntime])
+EMOTION_BATCH_WINDOW_MS = 5  # How long to gather concurrent messages into one batch
+EMOTION_MAX_BATCH = 32
+EMOTION_CACHE_SIZE = 4096  # Normalized messages whose label is remembered
+MAX_BATCH_SIZE = 8  # Sequences decoded together by the batch scheduler
+MAX_INFLIGHT_GENERATIONS = 32  # Queued plus running generations before /chat returns 503
+QUEUE_TIMEOUT = 2  # Seconds to wait for a generation slot
+SSE_HEARTBEAT = 5  # Idle seconds between keep-alive comments on the chat stream
+SSE_FLUSH_MS = 40  # Longest a streamed token waits to share a frame with the tokens after it
+SSE_FLUSH_BYTES = 256  # A frame is sent early once this much text is waiting
+SSE_RESUME_GRACE = 2  # Seconds a reply keeps generating after its client drops, for it to reconnect (0 cancels at once); keep above the 1 s EventSource retry
+PREFIX_CACHE_MB = 2048  # Memory budget for reused persona/history KV caches (0 disables)
+AUTOTUNE_PROFILE = True  # Use the threads/pinning/batch size saved by `python autotune.py` for this host
+
+# Shared inference processes started with `python inference_server.py --socket ...`.
+# When set, web workers only load the tokenizer and send prompts to these Unix
+# sockets instead of loading the model themselves (use one per GPU/NUMA node)
+INFERENCE_SERVERS = []  # e.g. ["data/inference.sock"]
+
+# Conversation storage: "sqlite" (persistent) or "memory"
+CONVERSATION_STORE = "sqlite"
+STORE_PATH = "data/conversations.db"
+STORE_CACHE_SIZE = 1024  # Sessions kept in the in-memory hot tier
+SECRET_KEY_PATH = "data/secret_key"  # Session signing key, kept across restarts
+HISTORY_COMMIT_TOKENS = 16  # Streamed replies are persisted in chunks of this many tokens
+SUMMARY_FOLD_TURNS = 4  # Turns past the history window folded into the running summary at once
+SUMMARY_TOKENS = 200  # Longest summary kept in the prompt
+
+# Long-term memory: lore chunks and past turns retrieved for each message
+MEMORY_INDEX_DIR = "data/vectors"  # On-disk lore indexes, one per character profile
+MEMORY_TOP_K = 4  # Snippets retrieved per message
+MEMORY_TOKENS = 300  # Prompt budget for retrieved snippets
+EMBEDDING_DIM = 512
+
+# Scraped character profiles
+PROFILE_CACHE_DIR = "data/profiles"
+PROFILE_CACHE_TTL = 24 * 3600  # Seconds before a cached profile is revalidated
+PROFILE_CACHE_PARTIAL_TTL = 300  # Seconds before a profile missing some enrichment is re-enriched
+PROFILE_CACHE_HOT_SIZE = 256  # Profiles kept in memory
+
+ENRICH_DEADLINE = 6  # Seconds allowed for all enrichment lookups together
+ENRICH_WORKERS = 8
+SCRAPER_PARSER = "html.parser"  # "lxml" parses several times faster when installed
+
+# Bulk import with `python import_characters.py`; profiles listed in
+# FEATURED_CHARACTERS have their persona prefilled when the app starts
+FEATURED_CHARACTERS = "data/featured.txt"  # Wiki URLs, one per line
+IMPORT_WORKERS = 8  # Characters imported at once
+IMPORT_HOST_RATE = 2  # Requests per second to any one host during an import
+IMPORT_ENRICH_DEADLINE = 60  # Imports can wait longer for throttled enrichment lookups
 
 # UI settings
 DEFAULT_CHARACTER_IMAGE = "static/icons/icon.jpg"
\ No newline at end of file
@@ -0,0 +1,464 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+from collections import OrderedDict
+from threading import Lock
+from config import HISTORY_LENGTH, STORE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def character_key(character):
+    """Characters are deduplicated by the wiki URL they were scraped from"""
+    return character.get('source_url') or character.get('name', 'Character')
+
+
+class MemoryStore:
+    """In-process conversation store with LRU eviction of idle sessions.
+
+    Each session keeps a reference to its character and the most recent
+    `history_length` turns, so every lookup is a dict access. Turns pushed
+    out of that window wait in "overflow" until the summarizer folds them
+    into the session's running summary.
+    """
+
+    def __init__(self, max_sessions=STORE_CACHE_SIZE, history_length=HISTORY_LENGTH):
+        self.max_sessions = max_sessions
+        self.history_length = history_length
+        self.sessions = OrderedDict()
+        self.characters = {}
+        self.lock = Lock()
+
+    def new_session(self):
+        return uuid.uuid4().hex
+
+    def _session(self, session_id, create=True):
+        conversation = self.sessions.get(session_id)
+        if conversation is None:
+            if not create:
+                return None
+            conversation = {"character": None, "history": [], "summary": "", "overflow": []}
+            self.sessions[session_id] = conversation
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session_id)
+        return conversation
+
+    def has_session(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
+
+    def save_character(self, character):
+        """Store a character profile and return its key"""
+        key = character_key(character)
+        with self.lock:
+            self.characters[key] = character
+        return key
+
+    def load_character(self, key):
+        with self.lock:
+            return self.characters.get(key)
+
+    def set_character(self, session_id, character):
+        """Point a session at a character and start a fresh history"""
+        key = self.save_character(character)
+        with self.lock:
+            conversation = self._session(session_id)
+            conversation["character"] = key
+            conversation["history"] = []
+            conversation["summary"] = ""
+            conversation["overflow"] = []
+        return key
+
+    def get_character(self, session_id):
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is None or conversation["character"] is None:
+                return {}
+            return self.characters.get(conversation["character"], {})
+
+    def get_history(self, session_id):
+        """Completed turns as dicts with 'user', 'bot' and 'bot_tokens'.
+
+        Turns that left the window but are not summarized yet come first, so
+        nothing disappears from the prompt while the summarizer catches up.
+        """
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is None:
+                return []
+            turns = conversation["overflow"] + conversation["history"]
+            return [dict(turn) for turn in turns if turn['done']]
+
+    def get_summary(self, session_id):
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            return conversation["summary"] if conversation is not None else ""
+
+    def pending_summary(self, session_id):
+        """Turns that left the history window and are not summarized yet"""
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is None:
+                return []
+            return list(conversation["overflow"])
+
+    def set_summary(self, session_id, summary, folded):
+        """Replace the summary after folding in `folded` from pending_summary.
+
+        Returns False (and changes nothing) if the history was cleared or the
+        character changed while the summary was being written.
+        """
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is None:
+                return False
+            overflow = conversation["overflow"]
+            if len(folded) > len(overflow) or any(a is not b for a, b in zip(folded, overflow)):
+                return False
+            conversation["summary"] = summary
+            del overflow[:len(folded)]
+            return True
+
+    def begin_turn(self, session_id, user):
+        """Start a turn whose reply is streamed in with append_reply"""
+        turn = {'user': user, 'bot': '', 'bot_tokens': [], 'done': False}
+        with self.lock:
+            self._session(session_id)["history"].append(turn)
+        return turn
+
+    def append_reply(self, session_id, turn, text, token_ids=()):
+        """Add a chunk of streamed reply text and the token IDs behind it"""
+        with self.lock:
+            turn['bot'] += text
+            turn['bot_tokens'].extend(token_ids)
+
+    def finish_turn(self, session_id, turn, bot=None, bot_tokens=None):
+        """Final commit of a turn, optionally replacing the streamed reply"""
+        with self.lock:
+            if bot is not None:
+                turn['bot'] = bot
+            if bot_tokens is not None:
+                turn['bot_tokens'] = list(bot_tokens)
+            turn['done'] = True
+            conversation = self._session(session_id, create=False)
+            if conversation is None:
+                # Evicted while the reply streamed; a blank session would lose the character
+                return
+            history = conversation["history"]
+            overflow = conversation["overflow"]
+            overflow.extend(old for old in history[:-self.history_length] if old['done'])
+            del history[:-self.history_length]
+            # Without a summarizer keeping up, only hold on to one window's worth
+            del overflow[:-self.history_length]
+
+    def latest_reply(self, session_id):
+        """(reply text committed so far, finished?) of the session's newest turn"""
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is None or not conversation["history"]:
+                return "", True
+            turn = conversation["history"][-1]
+            return turn['bot'], turn['done']
+
+    def append_turn(self, session_id, user, bot, bot_tokens=()):
+        turn = self.begin_turn(session_id, user)
+        self.finish_turn(session_id, turn, bot, bot_tokens)
+
+    def clear_history(self, session_id):
+        with self.lock:
+            conversation = self._session(session_id, create=False)
+            if conversation is not None:
+                conversation["history"] = []
+                conversation["summary"] = ""
+                conversation["overflow"] = []
+
+
+class SQLiteStore(MemoryStore):
+    """SQLite-backed conversation store with an in-memory LRU hot tier.
+
+    Turns are written to an append-only table; clearing a conversation only
+    moves the session's history start marker. A streamed reply is appended
+    to reply_chunks as it is generated and written to its turn row once at
+    the end, so a crash mid-stream still leaves the partial reply on disk.
+
+    Several worker processes may share the database, so every write bumps
+    the session's revision and every read compares it (one primary-key
+    lookup) with the hot tier's copy, reloading the session when another
+    process changed it. Sessions that fell out of the hot tier are reloaded
+    the same way.
+    """
+
+    def __init__(self, path, max_sessions=STORE_CACHE_SIZE, history_length=HISTORY_LENGTH):
+        super().__init__(max_sessions, history_length)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS characters (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                character TEXT,
+                history_start INTEGER NOT NULL DEFAULT 0,
+                summary TEXT NOT NULL DEFAULT '',
+                summary_upto INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user TEXT NOT NULL,
+                bot TEXT NOT NULL,
+                bot_tokens TEXT NOT NULL DEFAULT '[]',
+                done INTEGER NOT NULL DEFAULT 1,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, id);
+            CREATE TABLE IF NOT EXISTS reply_chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                turn_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                tokens TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_turn ON reply_chunks (turn_id, id);
+        """)
+        # Databases created before token-level persistence lack these columns
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(turns)")}
+        if 'bot_tokens' not in columns:
+            self.db.execute("ALTER TABLE turns ADD COLUMN bot_tokens TEXT NOT NULL DEFAULT '[]'")
+        if 'done' not in columns:
+            self.db.execute("ALTER TABLE turns ADD COLUMN done INTEGER NOT NULL DEFAULT 1")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(sessions)")}
+        if 'summary' not in columns:
+            self.db.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+            self.db.execute("ALTER TABLE sessions ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+        if 'revision' not in columns:
+            self.db.execute("ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        self.db.commit()
+
+    def _execute(self, sql, params=()):
+        with self.db_lock:
+            cursor = self.db.execute(sql, params)
+            self.db.commit()
+            return cursor
+
+    def _returning(self, sql, params=()):
+        # RETURNING rows must be read before the statement can be committed
+        with self.db_lock:
+            rows = self.db.execute(sql, params).fetchall()
+            self.db.commit()
+            return rows
+
+    def _query(self, sql, params=()):
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _bump(self, session_id):
+        """Record a write to the session so other processes reload it"""
+        rows = self._returning(
+            "UPDATE sessions SET revision = revision + 1, updated = ? WHERE id = ? RETURNING revision",
+            (time.time(), session_id)
+        )
+        if rows:
+            self._written(session_id, rows[0][0])
+
+    def _written(self, session_id, revision):
+        # If no other process wrote in between, the hot tier is still current
+        with self.lock:
+            conversation = self.sessions.get(session_id)
+            if conversation is not None and conversation.get("revision", 0) == revision - 1:
+                conversation["revision"] = revision
+
+    def _load_session(self, session_id):
+        """Reload a session from disk unless the hot tier holds its latest revision"""
+        rows = self._query(
+            "SELECT character, history_start, summary, summary_upto, revision FROM sessions WHERE id = ?",
+            (session_id,)
+        )
+        if not rows:
+            return
+        key, history_start, summary, summary_upto, revision = rows[0]
+        with self.lock:
+            conversation = self.sessions.get(session_id)
+            if conversation is not None and conversation.get("revision") == revision:
+                return
+            # Replies this process is still streaming stay the live turn objects
+            live = {} if conversation is None else {
+                turn.get('id'): turn for turn in conversation["history"] if not turn['done']
+            }
+        if key is not None:
+            # Another process may have re-scraped the character
+            character = self._query("SELECT data FROM characters WHERE key = ?", (key,))
+            if character:
+                with self.lock:
+                    self.characters[key] = json.loads(character[0][0])
+        # The window plus up to one window of turns still waiting to be summarized
+        rows = self._query(
+            "SELECT id, user, bot, bot_tokens, done FROM turns "
+            "WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (session_id, max(history_start, summary_upto), 2 * self.history_length)
+        )
+        history = []
+        for turn_id, user, bot, bot_tokens, done in reversed(rows):
+            bot_tokens = json.loads(bot_tokens)
+            if not done and turn_id in live:
+                history.append(live[turn_id])
+                continue
+            if not done:
+                # Stream never finished: recover the reply from its chunks
+                chunks = self._query(
+                    "SELECT text, tokens FROM reply_chunks WHERE turn_id = ? ORDER BY id", (turn_id,)
+                )
+                bot = "".join(text for text, _ in chunks)
+                bot_tokens = [token for _, tokens in chunks for token in json.loads(tokens)]
+                if not bot:
+                    continue
+            history.append({'id': turn_id, 'user': user, 'bot': bot, 'bot_tokens': bot_tokens, 'done': True})
+        with self.lock:
+            conversation = self._session(session_id)
+            conversation["character"] = key
+            conversation["history"] = history[-self.history_length:]
+            conversation["overflow"] = history[:-self.history_length]
+            conversation["summary"] = summary
+            conversation["revision"] = revision
+
+    def has_session(self, session_id):
+        self._load_session(session_id)
+        return super().has_session(session_id)
+
+    def save_character(self, character):
+        key = super().save_character(character)
+        self._execute(
+            "INSERT OR REPLACE INTO characters (key, data, updated) VALUES (?, ?, ?)",
+            (key, json.dumps(character), time.time())
+        )
+        return key
+
+    def load_character(self, key):
+        character = super().load_character(key)
+        if character is None:
+            rows = self._query("SELECT data FROM characters WHERE key = ?", (key,))
+            if rows:
+                character = json.loads(rows[0][0])
+                with self.lock:
+                    self.characters[key] = character
+        return character
+
+    def set_character(self, session_id, character):
+        key = super().set_character(session_id, character)
+        revision = self._returning(
+            "INSERT INTO sessions (id, character, history_start, updated, revision) "
+            "VALUES (?, ?, (SELECT COALESCE(MAX(id), 0) FROM turns), ?, 1) "
+            "ON CONFLICT (id) DO UPDATE SET character = excluded.character, "
+            "history_start = excluded.history_start, summary = '', summary_upto = 0, "
+            "updated = excluded.updated, revision = revision + 1 RETURNING revision",
+            (session_id, key, time.time())
+        )[0][0]
+        self._written(session_id, revision)
+        return key
+
+    def get_character(self, session_id):
+        self._load_session(session_id)
+        return super().get_character(session_id)
+
+    def get_history(self, session_id):
+        self._load_session(session_id)
+        return super().get_history(session_id)
+
+    def get_summary(self, session_id):
+        self._load_session(session_id)
+        return super().get_summary(session_id)
+
+    def pending_summary(self, session_id):
+        self._load_session(session_id)
+        return super().pending_summary(session_id)
+
+    def set_summary(self, session_id, summary, folded):
+        if not super().set_summary(session_id, summary, folded):
+            return False
+        self._execute(
+            "UPDATE sessions SET summary = ?, summary_upto = ? WHERE id = ?",
+            (summary, folded[-1]['id'] if folded else 0, session_id)
+        )
+        self._bump(session_id)
+        return True
+
+    def begin_turn(self, session_id, user):
+        self._load_session(session_id)
+        turn = super().begin_turn(session_id, user)
+        with self.db_lock:
+            # _load_session only finds turns of sessions with a row, and a
+            # session chatting before it picks a character has none yet
+            self.db.execute(
+                "INSERT OR IGNORE INTO sessions (id, updated) VALUES (?, ?)", (session_id, time.time())
+            )
+            cursor = self.db.execute(
+                "INSERT INTO turns (session_id, user, bot, done, created) VALUES (?, ?, '', 0, ?)",
+                (session_id, user, time.time())
+            )
+            self.db.commit()
+        turn['id'] = cursor.lastrowid
+        self._bump(session_id)
+        return turn
+
+    def append_reply(self, session_id, turn, text, token_ids=()):
+        super().append_reply(session_id, turn, text, token_ids)
+        self._execute(
+            "INSERT INTO reply_chunks (turn_id, text, tokens) VALUES (?, ?, ?)",
+            (turn['id'], text, json.dumps(list(token_ids)))
+        )
+
+    def finish_turn(self, session_id, turn, bot=None, bot_tokens=None):
+        # A session evicted meanwhile is left out of the hot tier and reloaded,
+        # finished turn included, from disk on its next access
+        super().finish_turn(session_id, turn, bot, bot_tokens)
+        self._execute(
+            "UPDATE turns SET bot = ?, bot_tokens = ?, done = 1 WHERE id = ?",
+            (turn['bot'], json.dumps(turn['bot_tokens']), turn['id'])
+        )
+        self._bump(session_id)
+
+    def latest_reply(self, session_id):
+        # Read from disk: the reply may be streaming in another process
+        rows = self._query(
+            "SELECT id, bot, done FROM turns WHERE session_id = ? AND id > "
+            "COALESCE((SELECT history_start FROM sessions WHERE id = ?), 0) ORDER BY id DESC LIMIT 1",
+            (session_id, session_id)
+        )
+        if not rows:
+            return "", True
+        turn_id, bot, done = rows[0]
+        if not done:
+            chunks = self._query("SELECT text FROM reply_chunks WHERE turn_id = ? ORDER BY id", (turn_id,))
+            bot = "".join(text for text, in chunks)
+        return bot, bool(done)
+
+    def clear_history(self, session_id):
+        self._load_session(session_id)
+        super().clear_history(session_id)
+        self._execute(
+            "UPDATE sessions SET history_start = (SELECT COALESCE(MAX(id), 0) FROM turns), "
+            "summary = '', summary_upto = 0 WHERE id = ?",
+            (session_id,)
+        )
+        self._bump(session_id)
+
+
+def create_store(kind, path):
+    if kind == "sqlite":
+        logger.info(f"Using SQLite conversation store at: {path}")
+        return SQLiteStore(path)
+    if kind == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown conversation store: {kind}")
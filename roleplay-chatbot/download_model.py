@@ -1,18 +1,150 @@
-from huggingface_hub import snapshot_download
-import shutil
 import os
+import sys
+import time
+import fnmatch
+import hashlib
+import logging
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from model_manifest import build_manifest, write_manifest, load_manifest, HASH_CHUNK, MANIFEST_FILE
+from config import MODEL_PATH, MODEL_REPO, MODEL_ENDPOINT, DOWNLOAD_WORKERS, DOWNLOAD_RETRIES
 
-MODEL_ID = "PygmalionAI/pygmalion-2-7b"
-LOCAL_PATH = "./models/pygmalion-2-7b"
+logger = logging.getLogger(__name__)
 
-# Download model
-snapshot_download(
-    repo_id=MODEL_ID,
-    local_dir=LOCAL_PATH,
-    local_dir_use_symlinks=False,
-    revision="main",
-    ignore_patterns=["*.h5", "*.ot", "*.msgpack"],
-    allow_patterns=["*.json", "*.model", "*.safetensors", "*.py", "*.txt", "*.bin"]
-)
+ALLOW_PATTERNS = ["*.json", "*.model", "*.safetensors", "*.py", "*.txt", "*.bin"]
+IGNORE_PATTERNS = ["*.h5", "*.ot", "*.msgpack", MANIFEST_FILE]
+TIMEOUT = 30  # Seconds to connect, and between received chunks
 
-print(f"Model downloaded to {LOCAL_PATH}")
\ No newline at end of file
+
+def _session():
+    session = requests.Session()
+    token = os.environ.get("HF_TOKEN")
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+
+def list_files(session, endpoint, repo_id, revision):
+    """(commit, [{name, size, sha256}]) of the repo files to download"""
+    response = session.get(f"{endpoint}/api/models/{repo_id}/revision/{revision}",
+                           params={"blobs": "true"}, timeout=TIMEOUT)
+    response.raise_for_status()
+    info = response.json()
+    files = []
+    for sibling in info.get("siblings", []):
+        name = sibling["rfilename"]
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in ALLOW_PATTERNS):
+            continue
+        if any(fnmatch.fnmatch(name, pattern) for pattern in IGNORE_PATTERNS):
+            continue
+        # Only LFS files (the weights) come with a sha256 up front
+        lfs = sibling.get("lfs") or {}
+        files.append({"name": name, "size": lfs.get("size", sibling.get("size")), "sha256": lfs.get("sha256")})
+    return info.get("sha", revision), files
+
+
+def download_file(session, url, path, size=None, sha256=None, retries=DOWNLOAD_RETRIES):
+    """Download url to path, resuming a partial file; returns its sha256.
+
+    Bytes land in path + ".incomplete", so a dropped connection (or a killed
+    process) leaves a prefix that the next attempt continues with a Range
+    request. The prefix is hashed first, so the whole file is read once.
+    """
+    partial = path + ".incomplete"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for attempt in range(retries + 1):
+        digest = hashlib.sha256()
+        offset = 0
+        with open(partial, 'ab+') as f:
+            f.seek(0)
+            for block in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(block)
+                offset += len(block)
+        if size is not None and offset > size:
+            os.remove(partial)
+            continue
+        try:
+            if size is None or offset < size:
+                headers = {"Range": f"bytes={offset}-"} if offset else {}
+                with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code == 416:
+                        # The partial file is no prefix of this one; start over
+                        os.remove(partial)
+                        continue
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # Server ignored the range and sent the whole file
+                        digest, offset = hashlib.sha256(), 0
+                    with open(partial, 'ab' if offset else 'wb') as f:
+                        for block in response.iter_content(chunk_size=1024 * 1024):
+                            f.write(block)
+                            digest.update(block)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            logger.warning(f"Download of {url} interrupted ({e}); resuming (attempt {attempt + 1}/{retries})")
+            time.sleep(min(2 ** attempt, 30))
+            continue
+        if size is not None and os.path.getsize(partial) != size:
+            logger.warning(f"{url}: got {os.path.getsize(partial)} of {size} bytes; resuming")
+            continue
+        if sha256 is not None and digest.hexdigest() != sha256:
+            os.remove(partial)
+            raise ValueError(f"{url}: sha256 {digest.hexdigest()} does not match {sha256}")
+        os.replace(partial, path)
+        return digest.hexdigest()
+    raise IOError(f"Could not download {url} after {retries + 1} attempts")
+
+
+def download_model(repo_id=MODEL_REPO, local_path=MODEL_PATH, revision="main",
+                   endpoint=MODEL_ENDPOINT, workers=DOWNLOAD_WORKERS):
+    """Download the repo into local_path, then write its manifest"""
+    session = _session()
+    commit, files = list_files(session, endpoint, repo_id, revision)
+    # Files already complete are reused, with their hash from the old manifest
+    previous = (load_manifest(local_path) or {"files": {}})["files"]
+    hashes, pending = {}, []
+    for file in files:
+        path = os.path.join(local_path, file["name"])
+        known = previous.get(file["name"])
+        if (known and os.path.exists(path) and os.path.getsize(path) == known["size"]
+                and file["size"] in (None, known["size"]) and file["sha256"] in (None, known["sha256"])):
+            hashes[file["name"]] = known["sha256"]
+        else:
+            pending.append(file)
+
+    print(f"Downloading {len(pending)} of {len(files)} files from {repo_id}@{commit[:12]}")
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="download") as pool:
+        futures = {
+            pool.submit(download_file, session, f"{endpoint}/{repo_id}/resolve/{commit}/{file['name']}",
+                        os.path.join(local_path, file["name"]), file["size"], file["sha256"]): file["name"]
+            for file in pending
+        }
+        for future in as_completed(futures):
+            hashes[futures[future]] = future.result()
+            print(f"  {futures[future]}")
+
+    manifest = build_manifest(local_path, hashes, source={"repo": repo_id, "revision": commit, "endpoint": endpoint})
+    return write_manifest(local_path, manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the model and write its manifest")
+    parser.add_argument("--repo", default=MODEL_REPO)
+    parser.add_argument("--revision", default="main")
+    parser.add_argument("--dir", default=MODEL_PATH, help="Model directory")
+    parser.add_argument("--endpoint", default=os.environ.get("HF_ENDPOINT", MODEL_ENDPOINT))
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS, help="Files downloaded at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        path = download_model(args.repo, args.dir, args.revision, args.endpoint, args.workers)
+    except Exception as e:
+        print(f"Download failed: {e}")
+        return 1
+    print(f"Model downloaded to {args.dir} (manifest: {path})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
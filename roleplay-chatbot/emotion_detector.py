@@ -1,32 +1,135 @@
-from transformers import pipeline
+from transformers import pipeline, AutoTokenizer
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Thread, Lock
+import queue
+import re
+import time
 import logging
+from config import EMOTION_RUNTIME, EMOTION_BATCH_WINDOW_MS, EMOTION_MAX_BATCH, EMOTION_CACHE_SIZE
 
 logger = logging.getLogger(__name__)
 
+EMOTION_MODEL = "j-hartmann/emotion-english-distilroberta-base"
+
+def normalize_text(text):
+    """Cache key for a message: runs of whitespace do not change the label.
+
+    Case is kept, since the cased classifier labels "I HATE this" and
+    "i hate this" differently.
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
 class EmotionDetector:
     def __init__(self):
         self.model = None
+        self.cache = OrderedDict()
+        self.cache_lock = Lock()
+        self.pending = queue.Queue()
         self.load_model()
+        if self.model is not None:
+            # Micro-batching worker: concurrent requests share one forward pass
+            self.worker = Thread(target=self._run, daemon=True)
+            self.worker.start()
 
     def load_model(self):
         try:
             # Use a smaller model for faster inference
-            self.model = pipeline(
-                "text-classification", 
-                model="j-hartmann/emotion-english-distilroberta-base",
-                top_k=1
-            )
-            logger.info("Emotion detector loaded successfully.")
+            if EMOTION_RUNTIME == "onnx":
+                self.model = self._load_onnx()
+            else:
+                self.model = pipeline(
+                    "text-classification",
+                    model=EMOTION_MODEL,
+                    top_k=1
+                )
+                if EMOTION_RUNTIME == "int8":
+                    import torch
+                    self.model.model = torch.ao.quantization.quantize_dynamic(
+                        self.model.model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+            logger.info(f"Emotion detector loaded successfully ({EMOTION_RUNTIME}).")
         except Exception as e:
             logger.error(f"Error loading emotion detector: {e}")
             self.model = None
 
+    def _load_onnx(self):
+        # Optional dependency: pip install optimum[onnxruntime]
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        model = ORTModelForSequenceClassification.from_pretrained(EMOTION_MODEL, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL)
+        return pipeline("text-classification", model=model, tokenizer=tokenizer, top_k=1)
+
+    def _cached(self, key):
+        with self.cache_lock:
+            label = self.cache.get(key)
+            if label is not None:
+                self.cache.move_to_end(key)
+            return label
+
+    def _remember(self, key, label):
+        with self.cache_lock:
+            self.cache[key] = label
+            self.cache.move_to_end(key)
+            while len(self.cache) > EMOTION_CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def detect_emotion_async(self, text):
+        """Return a Future resolving to the emotion label for text"""
+        future = Future()
+        key = normalize_text(text)
+        if not key or self.model is None:
+            future.set_result("neutral")
+            return future
+        label = self._cached(key)
+        if label is not None:
+            future.set_result(label)
+            return future
+        self.pending.put((key, text, future))
+        return future
+
     def detect_emotion(self, text):
-        if not text.strip() or self.model is None:
-            return "neutral"
         try:
-            result = self.model(text)[0][0]
-            return result['label'].lower()
+            return self.detect_emotion_async(text).result(timeout=10)
         except Exception as e:
             logger.error(f"Emotion detection error: {e}")
-            return "neutral"
\ No newline at end of file
+            return "neutral"
+
+    def _collect(self):
+        """Wait for one request, then gather more for up to the batch window"""
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + EMOTION_BATCH_WINDOW_MS / 1000
+        while len(batch) < EMOTION_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical messages in one batch are classified once
+            waiting = OrderedDict()
+            originals = {}
+            for key, text, future in batch:
+                waiting.setdefault(key, []).append(future)
+                originals.setdefault(key, text)
+            keys = list(waiting)
+            # The key is only for caching; the model sees the message as written
+            texts = [originals[key] for key in keys]
+            try:
+                results = self.model(texts, batch_size=len(texts), truncation=True)
+                labels = [result[0]['label'].lower() for result in results]
+            except Exception as e:
+                logger.error(f"Emotion detection error: {e}")
+                labels = ["neutral"] * len(texts)
+            else:
+                for key, label in zip(keys, labels):
+                    self._remember(key, label)
+            for key, label in zip(keys, labels):
+                for future in waiting[key]:
+                    future.set_result(label)
@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+import platform
+import torch
+from threading import get_ident
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = "autotune.json"  # Kept in the model directory, one entry per kind of host and backend
+
+
+def allowed_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_key():
+    """Identifies the kind of host a profile applies to: CPU model and usable CPUs"""
+    return f"{_cpu_model()} x{len(allowed_cpus())}"
+
+
+def _core_id(cpu):
+    try:
+        with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return str(cpu)
+
+
+def physical_cores(cpus):
+    """The first CPU of each physical core among cpus"""
+    seen, first = set(), []
+    for cpu in cpus:
+        core = _core_id(cpu)
+        if core not in seen:
+            seen.add(core)
+            first.append(cpu)
+    return first
+
+
+def core_order(cpus):
+    """CPUs ordered one per physical core first, SMT siblings after"""
+    first = physical_cores(cpus)
+    return first + [cpu for cpu in cpus if cpu not in first]
+
+
+def pin_process(cpus):
+    """Restrict every thread of this process (and threads it starts later) to cpus"""
+    if not hasattr(os, "sched_setaffinity"):
+        return False
+    try:
+        tids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass  # The thread exited meanwhile
+    return True
+
+
+def _profile_path(model_path):
+    return os.path.join(model_path, PROFILE_FILE)
+
+
+def load_profile(model_path, backend):
+    """The saved tuning of backend for this kind of host, or None"""
+    try:
+        with open(_profile_path(model_path), "r", encoding="utf-8") as f:
+            return json.load(f).get(machine_key(), {}).get(backend)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def save_profile(model_path, backend, profile):
+    path = _profile_path(model_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles.setdefault(machine_key(), {})[backend] = profile
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_profile(profile):
+    """Set torch threading and CPU pinning from a profile; returns it"""
+    if not profile:
+        return None
+    torch.set_num_threads(profile["threads"])
+    try:
+        torch.set_num_interop_threads(profile["interop_threads"])
+    except RuntimeError:
+        # Fixed for the life of the process once torch has used it
+        pass
+    if profile.get("cpus"):
+        pin_process(profile["cpus"])
+    logger.info(
+        f"Applied tuning profile: {profile['threads']} threads, "
+        f"{'pinned to ' + str(profile['cpus']) if profile.get('cpus') else 'unpinned'}, "
+        f"batch {profile['max_batch_size']}"
+    )
+    return profile
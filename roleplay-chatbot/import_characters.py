@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from transformers import AutoTokenizer
+from scraper import load_character_profile, set_host_rate_limit
+from profile_cache import ProfileCache, read_catalog
+from vector_index import MemoryRetriever
+from prompts import PromptBuilder
+from inference_server import RemoteModel
+from config import (
+    PROFILE_CACHE_DIR, MEMORY_INDEX_DIR, FEATURED_CHARACTERS, IMPORT_WORKERS, IMPORT_HOST_RATE,
+    IMPORT_ENRICH_DEADLINE, INFERENCE_SERVERS
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("ROLEPLAY_MODEL_PATH", os.path.join(BASE_DIR, "models", "pygmalion-2-7b"))
+
+
+def load_prompt_builder(model_path):
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True, local_files_only=True)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, skipping persona tokenization: {e}")
+        return None
+    return PromptBuilder(tokenizer)
+
+
+def import_character(url, cache, retriever, prompt_builder=None, warm_model=None,
+                     deadline=IMPORT_ENRICH_DEADLINE, revalidate=False):
+    """Scrape, enrich and index one character; returns a summary of what was done"""
+    start_time = time.monotonic()
+    profile = load_character_profile(url, cache, deadline, revalidate)
+    result = {"url": url, "name": profile.get('name', 'Character'), "ok": cache.get(url) is not None}
+    if result["ok"]:
+        # Lore index goes to disk, where every app worker picks it up
+        result["lore_chunks"] = len(retriever.character_index(profile))
+        if prompt_builder is not None:
+            context, stats = prompt_builder.build_context(profile, "")
+            result["persona_tokens"] = stats["prompt_tokens"]
+            if warm_model is not None:
+                result["warmed"] = warm_model.warm(context)
+    result["seconds"] = round(time.monotonic() - start_time, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import characters in bulk so they are ready before traffic arrives")
+    parser.add_argument("catalog", nargs="?", default=os.path.join(BASE_DIR, FEATURED_CHARACTERS),
+                        help="File of wiki URLs, one per line")
+    parser.add_argument("--url", action="append", default=[], help="Extra wiki URL to import (repeatable)")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="Characters imported at once")
+    parser.add_argument("--host-rate", type=float, default=IMPORT_HOST_RATE,
+                        help="Requests per second to any one host (0 for no limit)")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate profiles that are still fresh")
+    parser.add_argument("--model", default=MODEL_PATH, help="Model directory, for the tokenizer")
+    parser.add_argument("--socket", action="append", default=None,
+                        help="Inference server to warm (repeatable, defaults to INFERENCE_SERVERS)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    urls = args.url
+    if os.path.exists(args.catalog):
+        urls = read_catalog(args.catalog) + urls
+    elif not urls:
+        parser.error(f"Catalog not found: {args.catalog}")
+
+    set_host_rate_limit(args.host_rate)
+    cache = ProfileCache(os.path.join(BASE_DIR, PROFILE_CACHE_DIR))
+    retriever = MemoryRetriever(os.path.join(BASE_DIR, MEMORY_INDEX_DIR))
+    prompt_builder = load_prompt_builder(args.model)
+    # Persona prefixes can only be warmed ahead of time in shared inference
+    # servers; the app prefills FEATURED_CHARACTERS itself when it starts
+    sockets = args.socket if args.socket is not None else [os.path.join(BASE_DIR, path) for path in INFERENCE_SERVERS]
+    warm_model = RemoteModel(args.model, sockets) if sockets and prompt_builder else None
+
+    start_time = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="import") as pool:
+        futures = {
+            pool.submit(import_character, url, cache, retriever, prompt_builder, warm_model,
+                        revalidate=args.refresh): url
+            for url in urls
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Error importing {futures[future]}: {e}")
+                result = {"url": futures[future], "ok": False}
+            results.append(result)
+            status = "ok" if result["ok"] else "FAILED"
+            details = ", ".join(
+                f"{key}={result[key]}" for key in ("name", "lore_chunks", "persona_tokens", "warmed", "seconds")
+                if key in result
+            )
+            print(f"[{len(results)}/{len(urls)}] {status} {result['url']} {details}")
+
+    failed = [result["url"] for result in results if not result["ok"]]
+    print(f"Imported {len(results) - len(failed)} of {len(urls)} characters in {time.monotonic() - start_time:.1f}s")
+    for url in failed:
+        print(f"  failed: {url}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
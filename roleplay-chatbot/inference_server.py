@@ -0,0 +1,307 @@
+import os
+import time
+import zlib
+import logging
+import argparse
+from threading import Thread
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from transformers import AutoTokenizer
+from model_handler import RoleplayModel, RoleplayModelBase, GenerationRequest, ServerBusyError
+from prompts import TokenizedText
+from metrics import TOKENIZE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("ROLEPLAY_MODEL_PATH", os.path.join(BASE_DIR, "models", "pygmalion-2-7b"))
+
+# Seconds between checks for a cancelled or vanished client while a request is idle
+CANCEL_POLL = 0.5
+
+
+def _pack(prompt):
+    """Prompt segments as (text, token_ids, special_tokens) tuples that survive pickling"""
+    if isinstance(prompt, str):
+        prompt = [prompt]
+    return [
+        (str(segment), getattr(segment, 'token_ids', None), getattr(segment, 'special_tokens', False))
+        for segment in prompt
+    ]
+
+
+def _unpack(segments):
+    return [
+        text if token_ids is None else TokenizedText(text, token_ids, special_tokens)
+        for text, token_ids, special_tokens in segments
+    ]
+
+
+def load_authkey(address, create=False):
+    """Secret a client must prove before the server unpickles anything it sends.
+
+    Kept in "<socket>.key", readable only by the user running the server; the
+    server creates it on first start and reuses it afterwards.
+    """
+    path = f"{address}.key"
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with open(fd, 'wb') as f:
+                f.write(os.urandom(32))
+    if os.stat(path).st_mode & 0o077:
+        raise PermissionError(f"Inference server key is readable by other users: {path}")
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class InferenceServer:
+    """Serves one RoleplayModel to any number of web workers over a Unix socket.
+
+    Each connection carries one message: a ping, a prefill, a warm (a
+    prefill that replies once the prefix is cached), or a submit whose text
+    chunks and token IDs are streamed back as they are decoded. Requests
+    from every worker land on the same batch scheduler and prefix cache. A
+    client that sends "cancel" or closes its connection stops its generation.
+    """
+
+    def __init__(self, model, address):
+        self.model = model
+        self.address = address
+
+    def serve_forever(self):
+        directory = os.path.dirname(self.address)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # A socket file left behind by a crashed server would block bind()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        authkey = load_authkey(self.address, create=True)
+        # The socket is created owner-only; a chmod after bind would leave a window
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info(f"Inference server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.error(f"Error accepting connection: {e}")
+                    continue
+                Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            op = message.get("op")
+            if op == "ping":
+                conn.send(("ready",))
+            elif op == "prefill":
+                self.model.prefill(_unpack(message["prompt"]))
+            elif op == "warm":
+                conn.send(("done", self.model.warm(_unpack(message["prompt"]))))
+            elif op == "submit":
+                self._generate(conn, message)
+            else:
+                conn.send(("error", f"Unknown operation: {op}"))
+
+    def _generate(self, conn, message):
+        try:
+            request = self.model.submit(_unpack(message["prompt"]), message["max_length"])
+        except ServerBusyError as e:
+            conn.send(("busy", str(e)))
+            return
+        except Exception as e:
+            logger.error(f"Error submitting request: {e}")
+            conn.send(("error", str(e)))
+            return
+
+        sent = 0
+        error = None
+        try:
+            # The tokenize time goes back to be recorded in the web worker's metrics
+            conn.send(("queued", request.tokenize_seconds))
+            for chunk in request.chunks(heartbeat=CANCEL_POLL):
+                if conn.poll():
+                    # Only "cancel" is ever sent mid-stream; EOF means the client is gone
+                    conn.recv()
+                    request.cancel()
+                    break
+                if chunk:
+                    token_ids = request.generated_ids[sent:]
+                    sent += len(token_ids)
+                    conn.send(("chunk", chunk, token_ids))
+        except (EOFError, OSError):
+            request.cancel()
+            return
+        except Exception as e:
+            error = str(e)
+        request.finished.wait()
+        try:
+            # The full list, as a stop sequence may have trimmed IDs already sent
+            conn.send(("done", request.generated_ids, error))
+        except OSError:
+            pass
+
+
+class RemoteRequest(GenerationRequest):
+    """GenerationRequest whose tokens arrive from an inference server"""
+
+    def __init__(self, conn, max_new_tokens):
+        super().__init__([], max_new_tokens)
+        self.conn = conn
+        self.reader = Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def cancel(self):
+        if self.cancelled or self.finished.is_set():
+            return
+        super().cancel()
+        try:
+            self.conn.send("cancel")
+        except OSError:
+            pass
+
+    def _read(self):
+        try:
+            while True:
+                message = self.conn.recv()
+                if message[0] == "chunk":
+                    _, chunk, token_ids = message
+                    self.generated_ids.extend(token_ids)
+                    self.push(chunk)
+                elif message[0] == "done":
+                    _, token_ids, error = message
+                    self.generated_ids[:] = token_ids
+                    self.finish(RuntimeError(error) if error else None)
+                    return
+        except (EOFError, OSError) as e:
+            self.finish(ConnectionError(f"Lost connection to inference server: {e}"))
+        finally:
+            self.conn.close()
+
+
+class RemoteModel(RoleplayModelBase):
+    """Drop-in RoleplayModel for web workers that use shared inference servers.
+
+    Only the tokenizer is loaded locally (for prompt budgeting). Prompts are
+    routed by their system block, so a character keeps hitting the same
+    server's prefix cache when several servers (one per GPU or NUMA node)
+    are configured.
+    """
+
+    def __init__(self, model_path, addresses):
+        super().__init__(model_path)
+        self.addresses = list(addresses)
+        self.authkeys = {}
+        self._tokenizer = None
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer
+
+    @property
+    def model(self):
+        return None
+
+    def load_tokenizer(self):
+        logger.info("Loading tokenizer...")
+        self._tokenizer = AutoTokenizer.from_pretrained(
+            self.model_path,
+            use_fast=True,
+            local_files_only=True
+        )
+
+    def wait_ready(self, timeout=600):
+        """Block until every inference server answers a ping"""
+        deadline = time.monotonic() + timeout
+        for address in self.addresses:
+            while True:
+                try:
+                    with self._client(address) as conn:
+                        conn.send({"op": "ping"})
+                        conn.recv()
+                    break
+                except (OSError, EOFError, AuthenticationError):
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Inference server not available at {address}")
+                    time.sleep(1)
+            logger.info(f"Connected to inference server at {address}")
+
+    def _client(self, address):
+        # Read once the server has created it; a restarted server keeps its key
+        if address not in self.authkeys:
+            self.authkeys[address] = load_authkey(address)
+        return Client(address, family='AF_UNIX', authkey=self.authkeys[address])
+
+    def _connect(self, segments):
+        key = segments[0][0].encode('utf-8') if segments else b''
+        address = self.addresses[zlib.crc32(key) % len(self.addresses)]
+        return self._client(address)
+
+    def submit(self, prompt, max_length=200):
+        segments = _pack(prompt)
+        conn = self._connect(segments)
+        try:
+            conn.send({"op": "submit", "prompt": segments, "max_length": max_length})
+            reply = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        if reply[0] == "queued":
+            if len(reply) > 1 and reply[1] is not None:
+                TOKENIZE_SECONDS.observe(reply[1])
+            return RemoteRequest(conn, max_length)
+        conn.close()
+        if reply[0] == "busy":
+            raise ServerBusyError(reply[1])
+        raise RuntimeError(reply[1])
+
+    def prefill(self, segments):
+        """Ask the server to prefill a prefix; does not wait for it"""
+        if not segments:
+            return None
+        segments = _pack(segments)
+        try:
+            with self._connect(segments) as conn:
+                conn.send({"op": "prefill", "prompt": segments})
+        except (OSError, AuthenticationError) as e:
+            logger.warning(f"Prefill request failed: {e}")
+        return None
+
+    def warm(self, segments):
+        """Prefill a prefix on its server and wait; True if it is now cached there"""
+        if not segments:
+            return False
+        segments = _pack(segments)
+        try:
+            with self._connect(segments) as conn:
+                conn.send({"op": "warm", "prompt": segments})
+                return conn.recv()[1]
+        except (OSError, EOFError, AuthenticationError) as e:
+            logger.warning(f"Warm request failed: {e}")
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the roleplay model to web workers over a Unix socket")
+    parser.add_argument("--socket", default=os.path.join(BASE_DIR, "data", "inference.sock"),
+                        help="Unix socket path to listen on")
+    parser.add_argument("--model", default=MODEL_PATH, help="Model directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    InferenceServer(RoleplayModel(args.model), args.socket).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
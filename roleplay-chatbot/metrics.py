@@ -0,0 +1,198 @@
+import math
+from bisect import bisect_left
+from threading import Lock
+
+# Bucket upper bounds shared by the chat pipeline histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 200, 500)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}"
+        ]
+
+
+class Gauge:
+    """A value read from `read()` whenever metrics are exported"""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    @property
+    def value(self):
+        try:
+            return self.read()
+        except Exception:
+            return float('nan')
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}"
+        ]
+
+
+class CallbackCounter(Gauge):
+    """A running total kept elsewhere (e.g. cache hits), read when exported"""
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}"
+        ]
+
+
+class Histogram:
+    """Bucketed observations; percentiles are interpolated within a bucket"""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def percentile(self, q):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def summary(self):
+        with self.lock:
+            count, total = self.count, self.sum
+        return {
+            "count": count,
+            "mean": round(total / count, 4) if count else None,
+            "p50": _round(self.percentile(0.5)),
+            "p99": _round(self.percentile(0.99))
+        }
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram"
+        ]
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            # Re-registering a name (e.g. on module reload) returns the original
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, read):
+        with self.lock:
+            self.metrics[name] = Gauge(name, help, read)
+            return self.metrics[name]
+
+    def callback_counter(self, name, help, read):
+        with self.lock:
+            self.metrics[name] = CallbackCounter(name, help, read)
+            return self.metrics[name]
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Counters, gauges and histogram percentiles as a dict for /status"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: metric.summary() if isinstance(metric, Histogram) else metric.value
+            for metric in metrics
+        }
+
+
+REGISTRY = Registry()
+
+# Per-stage timings of a chat turn
+EMOTION_SECONDS = REGISTRY.histogram(
+    "chat_emotion_seconds", "Time spent waiting for the emotion classifier")
+PROMPT_BUILD_SECONDS = REGISTRY.histogram(
+    "chat_prompt_build_seconds", "Time spent fitting persona and history into the token budget")
+TOKENIZE_SECONDS = REGISTRY.histogram(
+    "chat_tokenize_seconds", "Time spent tokenizing the prompt before queueing it")
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "chat_time_to_first_token_seconds", "Time from queueing a prompt to its first token (queue wait plus prefill)")
+DECODE_RATE = REGISTRY.histogram(
+    "chat_decode_tokens_per_second", "Decode speed after the first token", RATE_BUCKETS)
+GENERATED_TOKENS = REGISTRY.histogram(
+    "chat_generated_tokens", "Tokens generated per reply", TOKEN_BUCKETS)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "chat_prompt_tokens", "Prompt length in tokens", TOKEN_BUCKETS)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "chat_request_seconds", "Total time to produce a reply")
+
+CHAT_REQUESTS = REGISTRY.counter("chat_requests_total", "Chat turns answered")
+CHAT_REJECTED = REGISTRY.counter("chat_rejected_total", "Chat turns refused because the server was busy")
+CHAT_ERRORS = REGISTRY.counter("chat_errors_total", "Chat turns that failed with an error")
@@ -1,123 +1,988 @@
 import os
+import time
+import queue
+import inspect
 import torch
 import logging
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
-from threading import Thread
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StaticCache, CompileConfig
+from transformers.generation import (
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TemperatureLogitsWarper,
+    TopPLogitsWarper
+)
+from transformers.generation.streamers import BaseStreamer
+from functools import lru_cache
+from threading import Thread, Event, Condition, BoundedSemaphore
+from config import (
+    MAX_BATCH_SIZE, PREFIX_CACHE_MB, CONTEXT_TOKENS, INFERENCE_BACKEND, GGUF_FILE,
+    MAX_INFLIGHT_GENERATIONS, QUEUE_TIMEOUT, DECODE_MODE, SPECULATIVE_DRAFT_MODEL,
+    PROMPT_LOOKUP_TOKENS, STOP_SEQUENCES, COMPILE_CACHE_DIR, AUTOTUNE_PROFILE
+)
+from prefix_cache import PrefixCache
+from host_profile import load_profile, apply_profile
+from model_manifest import load_manifest, check_manifest, MANIFEST_FILE
+from metrics import TOKENIZE_SECONDS
+from prompts import tokenize_segment
 
 logger = logging.getLogger(__name__)
 
-class RoleplayModel:
-    def __init__(self, model_path):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+# Sampling settings shared by every generation path
+TEMPERATURE = 0.85
+TOP_P = 0.92
+REPETITION_PENALTY = 1.15
+
+
+class ServerBusyError(RuntimeError):
+    """Raised when too many generations are already queued or running"""
+
+
+def _cache_layers(cache):
+    """Return the (key, value) tensors of every layer in a KV cache"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(k, v) for k, v in cache]
+
+
+def _build_cache(layers):
+    """Build a DynamicCache from per-layer (key, value) tensors"""
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(layers):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def _partial_stop(text, stops, start):
+    """Length of the longest tail of text[start:] that could begin a stop sequence"""
+    longest = 0
+    for stop in stops:
+        for size in range(min(len(stop) - 1, len(text) - start), longest, -1):
+            if text.endswith(stop[:size]):
+                longest = size
+                break
+    return longest
+
+
+def _left_pad(tensor, length):
+    """Left-pad a (batch, heads, seq, dim) cache tensor to `length` positions"""
+    pad = length - tensor.shape[2]
+    if pad <= 0:
+        return tensor
+    padding = tensor.new_zeros(tensor.shape[0], tensor.shape[1], pad, tensor.shape[3])
+    return torch.cat([padding, tensor], dim=2)
+
+
+class GenerationRequest:
+    """A prompt queued on the scheduler and the text stream it produces.
+
+    Decoded text is checked against the stop sequences as tokens arrive. Text
+    that could be the start of one is held back until it is ruled out, and on
+    a match the reply and its token IDs are cut where the stop begins and
+    `stopped` tells the scheduler to end the sequence.
+    """
+
+    def __init__(self, input_ids, max_new_tokens, cache_points=(), stop=STOP_SEQUENCES):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.cache_points = cache_points  # Prefix lengths worth keeping in the prefix cache
+        self.stop = tuple(stop)
+        self.stopped = False
+        self._stop_ids = None
+        self.generated_ids = []
+        self.text = ""
+        self.error = None
+        self.finished = Event()
+        self._updated = Condition()  # Notified when text grows or generation ends
+        self._chunks = queue.Queue()
+        self._cancelled = Event()
+        self._callbacks = []
+        self._emitted = 0  # Characters of decoded text already pushed
+        self.submitted_at = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+        self.tokenize_seconds = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Ask the scheduler to drop this sequence at the next token boundary"""
+        self._cancelled.set()
+
+    def push(self, chunk):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        with self._updated:
+            self.text += chunk
+            self._updated.notify_all()
+        self._chunks.put(chunk)
+
+    def add_tokens(self, token_ids, tokenizer):
+        """Append generated tokens and push the newly decoded text"""
+        if self.stopped:
+            return
+        if self._stop_ids is None:
+            # Stops the tokenizer has as single added tokens vanish from decoded text
+            added = tokenizer.get_added_vocab()
+            self._stop_ids = {added[stop] for stop in self.stop if stop in added}
+        stop_at = next((i for i, token in enumerate(token_ids) if token in self._stop_ids), None)
+        if stop_at is not None:
+            token_ids = token_ids[:stop_at]
+        self.generated_ids.extend(token_ids)
+        self._push_decoded(tokenizer, final=stop_at is not None)
+        if stop_at is not None:
+            self.stopped = True
+
+    def flush(self, tokenizer):
+        """Push any text held back by add_tokens"""
+        if not self.stopped:
+            self._push_decoded(tokenizer, final=True)
+
+    def _push_decoded(self, tokenizer, final):
+        text = tokenizer.decode(self.generated_ids, skip_special_tokens=True)
+        # Hold back incomplete multi-byte characters until the next token
+        if text.endswith("\ufffd") and not final:
+            return
+        end = len(text)
+        # Pushed text was already ruled out, so a stop can only start after it
+        for stop in self.stop:
+            position = text.find(stop, self._emitted, end + len(stop) - 1)
+            if position != -1:
+                end = position
+                self.stopped = True
+        if self.stopped:
+            self._trim_ids(tokenizer, end)
+        elif not final:
+            end -= _partial_stop(text, self.stop, self._emitted)
+        if end > self._emitted:
+            self.push(text[self._emitted:end])
+            self._emitted = end
+
+    def _trim_ids(self, tokenizer, end):
+        """Drop the tokens of a matched stop sequence and anything after it"""
+        # A stop starts within the last few tokens, so only a few decodes are needed.
+        # A token straddling the stop is dropped with it.
+        count = len(self.generated_ids)
+        while count and len(tokenizer.decode(self.generated_ids[:count], skip_special_tokens=True)) > end:
+            count -= 1
+        del self.generated_ids[count:]
+
+    def finish(self, error=None):
+        self.finished_at = time.monotonic()
+        self.error = error
+        with self._updated:
+            self.finished.set()
+            self._updated.notify_all()
+            # Taken under the lock so each callback runs exactly once, here or
+            # in add_done_callback, even if finish() is called again
+            callbacks, self._callbacks = self._callbacks, []
+        self._chunks.put(None)
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(request) once generation has finished"""
+        with self._updated:
+            if not self.finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait_for_text(self, offset, timeout=None):
+        """Wait until the text runs past `offset` or generation ends; False on timeout"""
+        with self._updated:
+            return self._updated.wait_for(lambda: len(self.text) > offset or self.finished.is_set(), timeout)
+
+    def __iter__(self):
+        return self.chunks()
+
+    def chunks(self, heartbeat=None):
+        """Yield text chunks; with a heartbeat, yield "" after that many idle seconds"""
+        while True:
+            try:
+                chunk = self._chunks.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ""
+                continue
+            if chunk is None:
+                break
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def timings(self):
+        """Time to first token, decode tokens/sec and token count of a finished request"""
+        ttft = decode_rate = None
+        if self.first_token_at is not None:
+            ttft = self.first_token_at - self.submitted_at
+            decode_time = (self.finished_at or time.monotonic()) - self.first_token_at
+            if decode_time > 0 and len(self.generated_ids) > 1:
+                decode_rate = (len(self.generated_ids) - 1) / decode_time
+        return {"ttft": ttft, "decode_rate": decode_rate, "tokens": len(self.generated_ids)}
+
+    def result(self, timeout=None):
+        """Block until generation ends and return the full reply"""
+        if not self.finished.wait(timeout):
+            raise TimeoutError("Generation timed out")
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+class _Sequence:
+    """Scheduler-side state of one running request"""
+
+    def __init__(self, request):
+        self.request = request
+        self.token_ids = list(request.input_ids)
+        self.length = 0  # Tokens currently held in the KV cache
+        self.next_token = None
+
+
+class BatchScheduler:
+    """Continuous-batching decode loop shared by all sessions.
+
+    Requests from every session are queued here and decoded together in one
+    batch. New sequences are prefilled and joined at token boundaries;
+    finished or cancelled ones leave the batch without stopping the others.
+    """
+
+    def __init__(self, model, tokenizer, device, max_batch_size=MAX_BATCH_SIZE, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.pending = queue.Queue()
+        self.active = []
+        self.cache_layers = None
+        self.attention_mask = None
+        self.processors = LogitsProcessorList([
+            RepetitionPenaltyLogitsProcessor(REPETITION_PENALTY),
+            TemperatureLogitsWarper(TEMPERATURE),
+            TopPLogitsWarper(TOP_P)
+        ])
+
+        # Only compute logits for the last position during prefill
+        forward_params = inspect.signature(model.forward).parameters
+        if "logits_to_keep" in forward_params:
+            self.logits_kwargs = {"logits_to_keep": 1}
+        elif "num_logits_to_keep" in forward_params:
+            self.logits_kwargs = {"num_logits_to_keep": 1}
+        else:
+            self.logits_kwargs = {}
+
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, input_ids, max_new_tokens, cache_points=()):
+        """Queue a tokenized prompt and return its GenerationRequest"""
+        request = GenerationRequest(list(input_ids), max_new_tokens, cache_points)
+        self.pending.put(request)
+        return request
+
+    def _run(self):
+        while True:
+            try:
+                self._admit()
+                if self.active:
+                    self._step()
+            except Exception as e:
+                logger.error(f"Batch scheduler error: {e}")
+                self._fail_all(e)
+
+    def _admit(self):
+        """Prefill waiting requests and join them to the running batch"""
+        while len(self.active) < self.max_batch_size:
+            try:
+                # Block only when there is nothing to decode
+                request = self.pending.get(block=not self.active)
+            except queue.Empty:
+                return
+            if request.cancelled:
+                request.finish()
+                continue
+            try:
+                self._join(request)
+            except Exception as e:
+                logger.error(f"Error prefilling request: {e}")
+                request.finish(e)
+
+    @torch.inference_mode()
+    def _join(self, request):
+        seq = _Sequence(request)
+        cached, past = 0, None
+        if self.prefix_cache is not None:
+            cached, prefix_layers = self.prefix_cache.lookup(seq.token_ids)
+            if prefix_layers is not None:
+                past = _build_cache(prefix_layers)
+
+        # Prefill only the part of the prompt that is not cached
+        input_ids = torch.tensor([seq.token_ids[cached:]], device=self.device)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=torch.ones(1, len(seq.token_ids), dtype=torch.long, device=self.device),
+            past_key_values=past,
+            use_cache=True,
+            **self.logits_kwargs
+        )
+        seq.length = len(seq.token_ids)
+        layers = _cache_layers(outputs.past_key_values)
+        self._store_prefixes(seq, layers, cached)
+        if request.max_new_tokens <= 0:
+            # Prefill-only request that just warms the prefix cache
+            request.finish()
+            return
+        mask = torch.ones(1, seq.length, dtype=torch.long, device=self.device)
+
+        if self.active:
+            total = max(self.attention_mask.shape[1], seq.length)
+            self.cache_layers = [
+                (torch.cat([_left_pad(k, total), _left_pad(nk, total)]),
+                 torch.cat([_left_pad(v, total), _left_pad(nv, total)]))
+                for (k, v), (nk, nv) in zip(self.cache_layers, layers)
+            ]
+            self.attention_mask = torch.cat([
+                self._pad_mask(self.attention_mask, total),
+                self._pad_mask(mask, total)
+            ])
+        else:
+            self.cache_layers = layers
+            self.attention_mask = mask
+
+        self.active.append(seq)
+        self._sample([seq], outputs.logits[:, -1, :])
+
+    def _store_prefixes(self, seq, layers, cached):
+        if self.prefix_cache is None:
+            return
+        for point in seq.request.cache_points:
+            prefix = seq.token_ids[:point]
+            if point <= cached or prefix in self.prefix_cache:
+                continue
+            # Clone so the cache does not pin the whole prefill tensor
+            self.prefix_cache.store(prefix, [
+                (k[:, :, :point].clone(), v[:, :, :point].clone()) for k, v in layers
+            ])
+
+    @staticmethod
+    def _pad_mask(mask, length):
+        pad = length - mask.shape[1]
+        if pad <= 0:
+            return mask
+        return torch.cat([mask.new_zeros(mask.shape[0], pad), mask], dim=1)
+
+    @torch.inference_mode()
+    def _step(self):
+        """Run one decode step for every sequence in the batch"""
+        input_ids = torch.tensor([[seq.next_token] for seq in self.active], device=self.device)
+        position_ids = torch.tensor([[seq.length] for seq in self.active], device=self.device)
+        self.attention_mask = torch.cat(
+            [self.attention_mask, self.attention_mask.new_ones(len(self.active), 1)], dim=1
+        )
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=self.attention_mask,
+            position_ids=position_ids,
+            past_key_values=_build_cache(self.cache_layers),
+            use_cache=True
+        )
+        self.cache_layers = _cache_layers(outputs.past_key_values)
+        for seq in self.active:
+            seq.length += 1
+        self._sample(self.active, outputs.logits[:, -1, :])
+
+    def _sample(self, sequences, logits):
+        """Pick the next token for each sequence and retire finished ones"""
+        finished = []
+        for row, seq in zip(logits, sequences):
+            ids = torch.tensor([seq.token_ids], device=row.device)
+            scores = self.processors(ids, row.unsqueeze(0).float())
+            probs = torch.softmax(scores, dim=-1)
+            token = int(torch.multinomial(probs, num_samples=1)[0, 0])
+
+            request = seq.request
+            if token == self.tokenizer.eos_token_id:
+                finished.append(seq)
+                continue
+            seq.token_ids.append(token)
+            seq.next_token = token
+            request.add_tokens([token], self.tokenizer)
+            if request.cancelled or request.stopped or len(request.generated_ids) >= request.max_new_tokens:
+                finished.append(seq)
+
+        if finished:
+            self._retire(finished)
+
+    def _retire(self, finished):
+        for seq in finished:
+            seq.request.flush(self.tokenizer)
+            seq.request.finish()
+
+        keep = [i for i, seq in enumerate(self.active) if seq not in finished]
+        self.active = [self.active[i] for i in keep]
+        if not self.active:
+            self.cache_layers = None
+            self.attention_mask = None
+            return
+
+        index = torch.tensor(keep, device=self.attention_mask.device)
+        mask = self.attention_mask.index_select(0, index)
+        # Drop left padding no remaining sequence needs
+        trim = int((mask.cumsum(dim=1) == 0).sum(dim=1).min())
+        self.attention_mask = mask[:, trim:]
+        self.cache_layers = [
+            (k.index_select(0, index.to(k.device))[:, :, trim:],
+             v.index_select(0, index.to(v.device))[:, :, trim:])
+            for k, v in self.cache_layers
+        ]
+
+    def _fail_all(self, error):
+        for seq in self.active:
+            seq.request.finish(error)
+        self.active = []
+        self.cache_layers = None
+        self.attention_mask = None
+
+class _RequestStreamer(BaseStreamer):
+    """Feeds tokens from model.generate into a GenerationRequest"""
+
+    def __init__(self, request, tokenizer, eos_token_id):
+        self.request = request
+        self.tokenizer = tokenizer
+        self.eos_token_id = eos_token_id
+        self.prompt_seen = False
+
+    def put(self, value):
+        # generate() passes the prompt first, then each accepted chunk of tokens
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        tokens = [token for token in value.reshape(-1).tolist() if token != self.eos_token_id]
+        if tokens:
+            self.request.add_tokens(tokens, self.tokenizer)
+
+    def end(self):
+        self.request.flush(self.tokenizer)
+
+
+class _RequestCriteria(StoppingCriteria):
+    """Stops generate() once the client has gone away or a stop sequence was hit"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = self.request.cancelled or self.request.stopped
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+
+class GenerateScheduler:
+    """Serves requests one at a time, in order, through model.generate"""
+
+    def __init__(self, model, tokenizer, device):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.pending = queue.Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, input_ids, max_new_tokens, cache_points=()):
+        request = GenerationRequest(list(input_ids), max_new_tokens, cache_points)
+        self.pending.put(request)
+        return request
+
+    def _generate_args(self, request):
+        eos_token_id = self.tokenizer.eos_token_id
+        return {
+            "input_ids": torch.tensor([request.input_ids], device=self.device),
+            "max_new_tokens": request.max_new_tokens,
+            "do_sample": True,
+            "temperature": TEMPERATURE,
+            "top_p": TOP_P,
+            "repetition_penalty": REPETITION_PENALTY,
+            "pad_token_id": eos_token_id,
+            "streamer": _RequestStreamer(request, self.tokenizer, eos_token_id),
+            "stopping_criteria": StoppingCriteriaList([_RequestCriteria(request)])
+        }
+
+    def _run(self):
+        while True:
+            request = self.pending.get()
+            # Prefill-only requests warm the batched prefix cache, which
+            # model.generate does not use
+            if request.cancelled or request.max_new_tokens <= 0:
+                request.finish()
+                continue
+            try:
+                with torch.no_grad():
+                    self.model.generate(**self._generate_args(request))
+                request.finish()
+            except Exception as e:
+                logger.error(f"{type(self).__name__} generation error: {e}")
+                request.finish(e)
+
+
+class SpeculativeScheduler(GenerateScheduler):
+    """Assisted decoding: a cheap drafter proposes tokens, the model verifies them.
+
+    The drafter is either a small model sharing the main model's vocabulary or,
+    without one, n-gram lookup in the prompt, which works well for roleplay as
+    replies keep repeating names and phrases from the persona and history.
+    Draft tokens are accepted with speculative sampling, so the output follows
+    the same temperature/top-p/repetition-penalty distribution as batched
+    decoding. Assisted generation runs one sequence at a time, so requests are
+    served in order by a single worker.
+    """
+
+    def __init__(self, model, tokenizer, device, draft_model=None, lookup_tokens=PROMPT_LOOKUP_TOKENS):
+        self.draft_model = draft_model
+        self.lookup_tokens = lookup_tokens
+        super().__init__(model, tokenizer, device)
+
+    def _generate_args(self, request):
+        args = super()._generate_args(request)
+        if self.draft_model is not None:
+            args["assistant_model"] = self.draft_model
+        else:
+            args["prompt_lookup_num_tokens"] = self.lookup_tokens
+        return args
+
+
+def enable_compile_cache(directory):
+    """Keep torch.compile's generated kernels in `directory` across restarts"""
+    os.makedirs(directory, exist_ok=True)
+    # Inductor reads its cache location from the environment when it compiles
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = directory
+    import torch._inductor.config as inductor_config
+    import torch._functorch.config as functorch_config
+    inductor_config.fx_graph_cache = True
+    functorch_config.enable_autograd_cache = True
+
+
+class CompiledScheduler(GenerateScheduler):
+    """Decoding with a preallocated static KV cache and a compiled decode step.
+
+    The KV cache is allocated once for `max_cache_len` positions and reset
+    between requests instead of growing every token. That gives the per-token
+    forward fixed shapes, so torch.compile turns it into one graph (replayed
+    as a CUDA graph on GPU). Prefill stays eager since prompt lengths vary.
+    Compiling takes a while on a cold start, so a short warm-up generation
+    runs before the first request is served; with enable_compile_cache later
+    starts load the kernels from disk instead.
+    """
+
+    def __init__(self, model, tokenizer, device, max_cache_len=CONTEXT_TOKENS):
+        self.cache = StaticCache(config=model.config, max_cache_len=max_cache_len)
+        self.compile_config = CompileConfig()
+        # transformers only compiles for accelerators unless told otherwise
+        self.compile_config._compile_all_devices = True
+        super().__init__(model, tokenizer, device)
+
+    def _generate_args(self, request):
+        args = super()._generate_args(request)
+        if self.cache.is_initialized:
+            self.cache.reset()
+        args["past_key_values"] = self.cache
+        args["compile_config"] = self.compile_config
+        # The cache cannot grow past its preallocated length
+        args["max_new_tokens"] = min(request.max_new_tokens, self.cache.get_max_length() - len(request.input_ids))
+        return args
+
+    def _warm_up(self):
+        start_time = time.monotonic()
+        request = GenerationRequest([self.tokenizer.bos_token_id or 0], 4, stop=())
+        try:
+            with torch.no_grad():
+                self.model.generate(**self._generate_args(request))
+            logger.info(f"Compiled decode step ready in {time.monotonic() - start_time:.1f}s")
+        except Exception as e:
+            logger.error(f"Compiled decode warm-up failed: {e}")
+
+    def _run(self):
+        self._warm_up()
+        super()._run()
+
+
+class TransformersBackend:
+    """HF transformers model decoded by the continuous-batching scheduler"""
+
+    required_files = [
+        "config.json", 
+        "tokenizer.json", 
+        "tokenizer.model",
+        "tokenizer_config.json"
+    ]
+    uses_prefix_cache = True  # Whether the scheduler can reuse HF KV caches
+
+    def __init__(self, model_path, device, prefix_cache=None):
         self.model_path = model_path
+        self.device = device
+        self.prefix_cache = prefix_cache
         self.tokenizer = None
         self.model = None
-        self.load_model()
+        self.draft_model = None
+        self.scheduler = None
+        self.max_batch_size = MAX_BATCH_SIZE
+        self.manifest = None
+
+    def verify_files(self):
+        # Verify model directory exists
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model directory not found: {self.model_path}")
+
+        # With a manifest, one stat per file catches missing and truncated files
+        self.manifest = load_manifest(self.model_path)
+        if self.manifest is not None:
+            problems = check_manifest(self.model_path, self.manifest, self.required_files)
+            if problems:
+                raise ValueError(f"Model files do not match {MANIFEST_FILE}: {'; '.join(problems)}")
+            return
+        logger.warning(f"No {MANIFEST_FILE} in {self.model_path}; run validate_model.py --write to create one")
+
+        # Verify essential files
+        for file in self.required_files:
+            file_path = os.path.join(self.model_path, file)
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"Required file not found: {file_path}")
+
+    def load(self):
+        self.verify_files()
+        self.load_tokenizer()
+        self.load_weights()
+        self.start()
+
+    def load_tokenizer(self):
+        logger.info("Loading tokenizer...")
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            self.model_path, 
+            use_fast=True,
+            local_files_only=True
+        )
+
+    def _check_weights(self):
+        if self.manifest is not None:
+            if self.manifest["format"] not in ("safetensors", "bin"):
+                raise ValueError(f"No model weights found (manifest lists {self.manifest['format']} weights)")
+            return self.manifest["format"] == "safetensors"
+        # Check for safetensors or pytorch files
+        model_files = os.listdir(self.model_path)
+        has_safetensors = any(f.endswith(".safetensors") for f in model_files)
+        has_pytorch_bin = any(f.startswith("pytorch_model") and f.endswith(".bin") for f in model_files)
+        
+        if not (has_safetensors or has_pytorch_bin):
+            raise ValueError("No model weights found (safetensors or pytorch bin files)")
+        return has_safetensors
+
+    def _load_args(self):
+        load_args = {
+            "pretrained_model_name_or_path": self.model_path,
+            "device_map": "auto",
+            "torch_dtype": torch.float16 if self.device == "cuda" else torch.float32,
+            "low_cpu_mem_usage": True,
+            "local_files_only": True
+        }
+        
+        if self.device == "cuda":
+            load_args["load_in_4bit"] = True
+            load_args["bnb_4bit_compute_dtype"] = torch.float16
+        return load_args
+
+    def load_weights(self):
+        logger.info("Loading model...")
+        load_args = self._load_args()
+        if self._check_weights():
+            # safetensors shards are memory-mapped instead of unpickled into RAM
+            load_args["use_safetensors"] = True
+        self.model = AutoModelForCausalLM.from_pretrained(**load_args)
+        self.model.eval()
+        if DECODE_MODE == "speculative" and SPECULATIVE_DRAFT_MODEL:
+            self.load_draft_model()
+
+    def load_draft_model(self):
+        logger.info(f"Loading draft model from: {SPECULATIVE_DRAFT_MODEL}")
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            SPECULATIVE_DRAFT_MODEL,
+            torch_dtype=self.model.dtype,
+            low_cpu_mem_usage=True,
+            local_files_only=True
+        ).to(self.model.device)
+        self.draft_model.eval()
+
+    def start(self):
+        if DECODE_MODE == "speculative":
+            self.scheduler = SpeculativeScheduler(
+                self.model, self.tokenizer, self.device, draft_model=self.draft_model
+            )
+        elif DECODE_MODE == "compiled":
+            enable_compile_cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPILE_CACHE_DIR))
+            self.scheduler = CompiledScheduler(self.model, self.tokenizer, self.device)
+        else:
+            self.scheduler = BatchScheduler(
+                self.model, self.tokenizer, self.device, self.max_batch_size, prefix_cache=self.prefix_cache
+            )
+
+    def tokenize(self, text, add_special_tokens=True):
+        return self.tokenizer(text, add_special_tokens=add_special_tokens)["input_ids"]
+
+    def submit(self, input_ids, max_new_tokens, cache_points=()):
+        return self.scheduler.submit(input_ids, max_new_tokens, cache_points)
+
+
+class QuantizedCPUBackend(TransformersBackend):
+    """Transformers model with int8 dynamically quantized linear layers.
+
+    Weights of every nn.Linear are stored as int8 and activations are
+    quantized on the fly, which cuts memory to roughly a quarter of float32
+    and uses the CPU's integer matmul kernels. Runs on the same scheduler.
+    """
+
+    def _load_args(self):
+        return {
+            "pretrained_model_name_or_path": self.model_path,
+            "torch_dtype": torch.float32,
+            "low_cpu_mem_usage": True,
+            "local_files_only": True
+        }
+
+    def load_weights(self):
+        super().load_weights()
+        logger.info("Quantizing linear layers to int8...")
+        self.model = torch.ao.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+
+class LlamaCppBackend(TransformersBackend):
+    """GGUF model served by llama.cpp (requires llama-cpp-python).
+
+    The HF tokenizer in the model directory is kept for prompt building, so
+    token IDs are shared with the other backends. llama.cpp reuses the KV
+    cache for the longest prefix it has already evaluated, so requests are
+    run one at a time by a worker thread.
+    """
+
+    required_files = [
+        "tokenizer.json",
+        "tokenizer_config.json"
+    ]
+    uses_prefix_cache = False  # llama.cpp keeps its own KV cache
+
+    def __init__(self, model_path, device, prefix_cache=None):
+        super().__init__(model_path, "cpu", prefix_cache=None)
+        self.gguf_path = os.path.join(model_path, GGUF_FILE)
+        self.pending = queue.Queue()
+
+    def load_weights(self):
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise ImportError("The gguf backend requires llama-cpp-python (pip install llama-cpp-python)")
+        if not os.path.exists(self.gguf_path):
+            raise FileNotFoundError(f"GGUF model not found: {self.gguf_path}")
+        logger.info(f"Loading GGUF model from: {self.gguf_path}")
+        self.model = Llama(model_path=self.gguf_path, n_ctx=CONTEXT_TOKENS, verbose=False)
+
+    def start(self):
+        self.scheduler = Thread(target=self._run, daemon=True)
+        self.scheduler.start()
+
+    def submit(self, input_ids, max_new_tokens, cache_points=()):
+        request = GenerationRequest(list(input_ids), max_new_tokens)
+        self.pending.put(request)
+        return request
+
+    def _run(self):
+        while True:
+            request = self.pending.get()
+            if request.cancelled or request.max_new_tokens <= 0:
+                request.finish()
+                continue
+            try:
+                tokens = self.model.generate(
+                    request.input_ids,
+                    temp=TEMPERATURE,
+                    top_p=TOP_P,
+                    repeat_penalty=REPETITION_PENALTY
+                )
+                for token in tokens:
+                    if token == self.model.token_eos():
+                        break
+                    request.add_tokens([token], self.tokenizer)
+                    if request.cancelled or request.stopped or len(request.generated_ids) >= request.max_new_tokens:
+                        break
+                request.flush(self.tokenizer)
+                request.finish()
+            except Exception as e:
+                logger.error(f"llama.cpp generation error: {e}")
+                request.finish(e)
+
+
+# Inference backends selectable with INFERENCE_BACKEND in config.py
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "int8": QuantizedCPUBackend,
+    "gguf": LlamaCppBackend
+}
+
+
+class RoleplayModelBase:
+    """Prompt encoding and reply streaming shared by local and remote models.
+
+    Subclasses provide `tokenizer`, `submit`, `prefill` and `warm`.
+    """
+
+    def __init__(self, model_path):
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model_path = model_path
+        # Without a prefix cache, prefill and warm are no-ops
+        self.prefix_cache = None
+        self._encode_segment = lru_cache(maxsize=4096)(self._tokenize_segment)
+
+    def _tokenize_segment(self, text, first):
+        return tokenize_segment(self.tokenizer, text, first)
+
+    def encode(self, prompt):
+        """Tokenize a prompt string or list of prompt segments.
+
+        Segments are tokenized separately, each in the context of the newline
+        before it, and concatenated so that a shared prefix (system block,
+        committed history turns) always produces the same token IDs. Segments
+        carrying `token_ids` (from PromptBuilder, or stored replies) are used
+        as-is, provided they include BOS exactly when they come first. Returns
+        the IDs and the length after each segment.
+        """
+        if isinstance(prompt, str):
+            prompt = [prompt]
+        input_ids = []
+        boundaries = []
+        for i, segment in enumerate(prompt):
+            token_ids = getattr(segment, 'token_ids', None)
+            if token_ids is None or (i == 0) != getattr(segment, 'special_tokens', False):
+                token_ids = self._encode_segment(str(segment), i == 0)
+            input_ids.extend(token_ids)
+            boundaries.append(len(input_ids))
+        return input_ids, boundaries
+
+    def generate_response(self, prompt, max_length=200):
+        try:
+            request = self.submit(prompt, max_length)
+            # Only generated token IDs are decoded, so no prompt splitting is needed
+            return request.result().strip()
+        except ServerBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return "I encountered an error. Please try again."
+    
+    def stream_response(self, prompt, max_length=200, heartbeat=None):
+        """Stream response token by token.
+
+        The prompt is queued immediately (so ServerBusyError is raised here,
+        not on first iteration). With a heartbeat, "" is yielded while the
+        request is idle so the caller can probe its client connection.
+        """
+        request = self.submit(prompt, max_length)
+        return self.stream(request, heartbeat)
+
+    def stream(self, request, heartbeat=None):
+        """Yield text chunks of a submitted request, cancelling it if closed early"""
+        try:
+            for new_token in request.chunks(heartbeat):
+                if new_token or heartbeat:
+                    yield new_token
+        finally:
+            # Closing the generator (e.g. client disconnect) stops decoding
+            # at the next token boundary
+            request.cancel()
+
+
+class RoleplayModel(RoleplayModelBase):
+    def __init__(self, model_path, backend=INFERENCE_BACKEND, load=True):
+        super().__init__(model_path)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        # Threads and pinning must be set before the model first runs
+        self.profile = apply_profile(load_profile(model_path, backend)) if AUTOTUNE_PROFILE else None
+        if PREFIX_CACHE_MB and BACKENDS[backend].uses_prefix_cache:
+            self.prefix_cache = PrefixCache(PREFIX_CACHE_MB * 1024 * 1024)
+        self.backend = BACKENDS[backend](model_path, self.device, prefix_cache=self.prefix_cache)
+        # A profile tuned without batching has no batch size to offer
+        if self.profile and self.profile.get("decode_mode", "batched") == "batched":
+            self.backend.max_batch_size = self.profile["max_batch_size"]
+        # Bounds queued plus running generations; callers beyond it get ServerBusyError
+        self.slots = BoundedSemaphore(MAX_INFLIGHT_GENERATIONS)
+        # With load=False the caller runs the backend's load stages itself
+        if load:
+            self.load_model()
+
+    @property
+    def tokenizer(self):
+        return self.backend.tokenizer
+
+    @property
+    def model(self):
+        return self.backend.model
     
     def load_model(self):
         try:
-            logger.info(f"Loading model from: {self.model_path}")
-            
-            # Verify model directory exists
-            if not os.path.exists(self.model_path):
-                raise FileNotFoundError(f"Model directory not found: {self.model_path}")
-            
-            # Verify essential files
-            required_files = [
-                "config.json", 
-                "tokenizer.json", 
-                "tokenizer.model",
-                "tokenizer_config.json"
-            ]
-            
-            for file in required_files:
-                file_path = os.path.join(self.model_path, file)
-                if not os.path.exists(file_path):
-                    raise FileNotFoundError(f"Required file not found: {file_path}")
-            
-            logger.info("Loading tokenizer...")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_path, 
-                use_fast=True,
-                local_files_only=True
-            )
-            
-            logger.info("Loading model...")
-            # Check for safetensors or pytorch files
-            model_files = os.listdir(self.model_path)
-            has_safetensors = any(f.endswith(".safetensors") for f in model_files)
-            has_pytorch_bin = any(f.startswith("pytorch_model") and f.endswith(".bin") for f in model_files)
-            
-            if not (has_safetensors or has_pytorch_bin):
-                raise ValueError("No model weights found (safetensors or pytorch bin files)")
-            
-            load_args = {
-                "pretrained_model_name_or_path": self.model_path,
-                "device_map": "auto",
-                "torch_dtype": torch.float16 if self.device == "cuda" else torch.float32,
-                "low_cpu_mem_usage": True,
-                "local_files_only": True
-            }
-            
-            if self.device == "cuda":
-                load_args["load_in_4bit"] = True
-                load_args["bnb_4bit_compute_dtype"] = torch.float16
-            
-            self.model = AutoModelForCausalLM.from_pretrained(**load_args)
+            logger.info(f"Loading model from: {self.model_path} ({type(self.backend).__name__})")
+            self.backend.load()
             logger.info("Model loaded successfully.")
-            
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             raise
     
-    def generate_response(self, prompt, max_length=200):
+    def submit(self, prompt, max_length=200):
+        """Tokenize a prompt and queue it on the batch scheduler"""
+        # Backpressure: wait briefly for a free slot, then refuse
+        if not self.slots.acquire(timeout=QUEUE_TIMEOUT):
+            raise ServerBusyError("Too many generations in progress")
         try:
-            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_length,
-                do_sample=True,
-                temperature=0.85,
-                top_p=0.92,
-                repetition_penalty=1.15,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            # Extract only the new response
-            return response.split(prompt)[-1].strip()
-        except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            return "I encountered an error. Please try again."
-    
-    def stream_response(self, prompt, max_length=200):
-        """Stream response token by token"""
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-        
-        # Create streamer
-        streamer = TextIteratorStreamer(
-            self.tokenizer, 
-            skip_prompt=True, 
-            timeout=20.0, 
-            skip_special_tokens=True
-        )
-        
-        # Generation parameters
-        generation_kwargs = dict(
-            **inputs,
-            streamer=streamer,
-            max_new_tokens=max_length,
-            do_sample=True,
-            temperature=0.85,
-            top_p=0.92,
-            repetition_penalty=1.15,
-            pad_token_id=self.tokenizer.eos_token_id
-        )
-        
-        # Start generation in a separate thread
-        thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-        thread.start()
-        
-        # Yield tokens as they come
-        for new_token in streamer:
-            if new_token:
-                yield new_token
\ No newline at end of file
+            start_time = time.monotonic()
+            input_ids, boundaries = self.encode(prompt)
+            tokenize_seconds = time.monotonic() - start_time
+            TOKENIZE_SECONDS.observe(tokenize_seconds)
+            # Cache the system block and everything before the new user turn
+            cache_points = sorted(set(boundaries[:1] + boundaries[-2:-1])) if len(boundaries) > 1 else []
+            request = self.backend.submit(input_ids, max_length, cache_points)
+            request.tokenize_seconds = tokenize_seconds
+        except Exception:
+            self.slots.release()
+            raise
+        request.add_done_callback(lambda _: self.slots.release())
+        return request
+
+    def prefill(self, segments):
+        """Start prefilling a prompt prefix into the prefix cache without waiting.
+
+        Returns the queued request, or None if the prefix is already cached or
+        the backend has no prefix cache.
+        """
+        if self.prefix_cache is None or not segments:
+            return None
+        input_ids, boundaries = self.encode(segments)
+        if input_ids in self.prefix_cache:
+            return None
+        # Prefill is only an optimization, so skip it rather than wait for a slot
+        if not self.slots.acquire(blocking=False):
+            return None
+        cache_points = sorted(set([boundaries[0], boundaries[-1]]))
+        request = self.backend.submit(input_ids, 0, cache_points)
+        request.add_done_callback(lambda _: self.slots.release())
+        return request
+
+    def warm(self, segments):
+        """Prefill a prompt prefix and wait for it; True if it is now in the prefix cache"""
+        if self.prefix_cache is None or not segments:
+            return False
+        request = self.prefill(segments)
+        if request is not None:
+            request.finished.wait()
+        return self.encode(segments)[0] in self.prefix_cache
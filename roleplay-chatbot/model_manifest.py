@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import logging
+from threading import get_ident
+from concurrent.futures import ThreadPoolExecutor
+from config import MANIFEST_HASH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_CHUNK = 8 * 1024 * 1024
+# Written next to the weights but not part of the model itself
+UNTRACKED = (MANIFEST_FILE, "autotune.json", ".*", "*.incomplete", "*.tmp")
+# Sharded checkpoints list their shards in an index; checked in this order
+WEIGHT_FORMATS = (
+    ("safetensors", "model.safetensors.index.json", "*.safetensors"),
+    ("bin", "pytorch_model.bin.index.json", "pytorch_model*.bin"),
+    ("gguf", None, "*.gguf"),
+)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        # hashlib drops the GIL on large buffers, so threads hash in parallel
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_files(model_path):
+    """Paths of the model's files relative to model_path, in '/' form"""
+    files = []
+    for root, dirs, names in os.walk(model_path):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for name in names:
+            if any(fnmatch.fnmatch(name, pattern) for pattern in UNTRACKED):
+                continue
+            path = os.path.relpath(os.path.join(root, name), model_path)
+            files.append(path.replace(os.sep, '/'))
+    return sorted(files)
+
+
+def weight_shards(model_path, files):
+    """(format, shard files) of the checkpoint among files, or (None, [])"""
+    for weight_format, index_file, pattern in WEIGHT_FORMATS:
+        if index_file in files:
+            with open(os.path.join(model_path, index_file), 'r', encoding='utf-8') as f:
+                return weight_format, sorted(set(json.load(f)["weight_map"].values()))
+        shards = [name for name in files if fnmatch.fnmatch(name, pattern)]
+        if shards:
+            return weight_format, shards
+    return None, []
+
+
+def _hash_all(model_path, names, workers=MANIFEST_HASH_WORKERS):
+    # Largest first, so one big shard does not start last and finish alone
+    names = sorted(names, key=lambda name: -os.path.getsize(os.path.join(model_path, name)))
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hash") as pool:
+        digests = pool.map(lambda name: sha256_file(os.path.join(model_path, name)), names)
+        return dict(zip(names, digests))
+
+
+def build_manifest(model_path, hashes=None, source=None, workers=MANIFEST_HASH_WORKERS):
+    """Describe the files now in model_path; `hashes` are sha256s already known"""
+    files = model_files(model_path)
+    hashes = dict(hashes or {})
+    hashes.update(_hash_all(model_path, [name for name in files if name not in hashes], workers))
+    weight_format, shards = weight_shards(model_path, files)
+    return {
+        "version": MANIFEST_VERSION,
+        "source": source,
+        "format": weight_format,
+        "shards": shards,
+        "files": {
+            name: {"size": os.path.getsize(os.path.join(model_path, name)), "sha256": hashes[name]}
+            for name in files
+        },
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_manifest(model_path, manifest):
+    path = os.path.join(model_path, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_manifest(model_path):
+    """The model's manifest, or None if it has none (or an unreadable one)"""
+    path = os.path.join(model_path, MANIFEST_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read model manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.error(f"Unsupported model manifest version: {manifest.get('version')}")
+        return None
+    return manifest
+
+
+def check_manifest(model_path, manifest, required=()):
+    """Problems found with one stat per file: missing files and wrong sizes"""
+    problems = [f"{name}: not in manifest" for name in required if name not in manifest["files"]]
+    for name in manifest["shards"]:
+        if name not in manifest["files"]:
+            problems.append(f"{name}: shard not in manifest")
+    for name, entry in manifest["files"].items():
+        try:
+            size = os.stat(os.path.join(model_path, name)).st_size
+        except FileNotFoundError:
+            problems.append(f"{name}: missing")
+            continue
+        if size != entry["size"]:
+            problems.append(f"{name}: {size} bytes, expected {entry['size']}")
+    return problems
+
+
+def verify_manifest(model_path, manifest, workers=MANIFEST_HASH_WORKERS):
+    """Problems found by check_manifest plus every file's sha256, hashed in parallel"""
+    problems = check_manifest(model_path, manifest)
+    if problems:
+        return problems
+    digests = _hash_all(model_path, list(manifest["files"]), workers)
+    return [
+        f"{name}: sha256 {digests[name]}, expected {entry['sha256']}"
+        for name, entry in manifest["files"].items() if digests[name] != entry["sha256"]
+    ]
@@ -0,0 +1,86 @@
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    """LRU store of KV caches keyed on tokenized prompt prefixes.
+
+    The system block of a character and the history already committed to a
+    conversation are the same from one turn to the next, so their
+    past_key_values can be reused instead of running prefill over them again.
+    Entries are evicted least-recently-used first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lengths = {}  # Prefix length -> number of entries with that length
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def _nbytes(layers):
+        return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+    def lookup(self, token_ids):
+        """Return (length, layers) for the longest cached proper prefix of token_ids"""
+        with self.lock:
+            # Leave at least one token to prefill so there are logits to sample from
+            for length in sorted(self.lengths, reverse=True):
+                if length >= len(token_ids):
+                    continue
+                key = tuple(token_ids[:length])
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return length, entry
+            self.misses += 1
+            return 0, None
+
+    def __contains__(self, token_ids):
+        with self.lock:
+            return tuple(token_ids) in self.entries
+
+    def store(self, token_ids, layers):
+        """Cache per-layer (key, value) tensors covering exactly token_ids"""
+        key = tuple(token_ids)
+        nbytes = self._nbytes(layers)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = layers
+            self.lengths[len(key)] = self.lengths.get(len(key), 0) + 1
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        key, layers = self.entries.popitem(last=False)
+        self.size -= self._nbytes(layers)
+        self.lengths[len(key)] -= 1
+        if not self.lengths[len(key)]:
+            del self.lengths[len(key)]
+        logger.debug(f"Evicted {len(key)}-token prefix from KV cache")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.lengths.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
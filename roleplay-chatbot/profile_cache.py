@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock, get_ident
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import PROFILE_CACHE_TTL, PROFILE_CACHE_PARTIAL_TTL, PROFILE_CACHE_HOT_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url):
+    """Canonical form of a wiki URL so the same page maps to one cache entry"""
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    if scheme == 'http':
+        scheme = 'https'
+    host = parts.netloc.lower()
+    path = parts.path.rstrip('/') or '/'
+    # Drop tracking parameters and keep the rest in a stable order
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query) if not k.startswith('utm_')
+    ))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def read_catalog(path):
+    """Wiki URLs listed one per line in path, skipping blanks, # comments and repeats"""
+    urls, seen = [], set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            url = line.split('#', 1)[0].strip()
+            if url and normalize_url(url) not in seen:
+                seen.add(normalize_url(url))
+                urls.append(url)
+    return urls
+
+
+class ProfileCache:
+    """Scraped character profiles on disk with an in-memory hot tier.
+
+    Each entry stores the profile along with the page's ETag and
+    Last-Modified headers. Entries older than `ttl` seconds are stale: they
+    are revalidated with a conditional request before being served again.
+    Partial entries (some enrichment lookups missed their deadline) go stale
+    after `partial_ttl` instead, so the lookups are retried soon.
+    """
+
+    def __init__(self, directory, ttl=PROFILE_CACHE_TTL, hot_size=PROFILE_CACHE_HOT_SIZE,
+                 partial_ttl=PROFILE_CACHE_PARTIAL_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.partial_ttl = partial_ttl
+        self.hot_size = hot_size
+        self.hot = OrderedDict()
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.hot[key] = entry
+            self.hot.move_to_end(key)
+            while len(self.hot) > self.hot_size:
+                self.hot.popitem(last=False)
+
+    def get(self, url):
+        """Return the cache entry for url (fresh or stale), or None"""
+        key = normalize_url(url)
+        with self.lock:
+            entry = self.hot.get(key)
+            if entry is not None:
+                self.hot.move_to_end(key)
+                return entry
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def is_fresh(self, entry):
+        ttl = self.partial_ttl if entry.get('partial') else self.ttl
+        return time.time() - entry['fetched'] < ttl
+
+    def put(self, url, profile, etag=None, last_modified=None, partial=False):
+        key = normalize_url(url)
+        entry = {
+            'url': key,
+            'fetched': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'partial': partial,
+            'profile': profile
+        }
+        self._write(key, entry)
+        return entry
+
+    def touch(self, entry):
+        """Mark an entry fresh again after a 304 Not Modified"""
+        entry = dict(entry, fetched=time.time())
+        self._write(entry['url'], entry)
+        return entry
+
+    def _write(self, key, entry):
+        self._remember(key, entry)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write profile cache entry for {key}: {e}")
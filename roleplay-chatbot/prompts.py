@@ -1,38 +1,265 @@
-def create_character_prompt(character_data, user_input, emotion, history_text=""):
-    character_name = character_data.get('name', 'Character')
-    
+from functools import lru_cache
+from config import CONTEXT_TOKENS, MAX_RESPONSE_LENGTH, SUMMARY_TOKENS, MEMORY_TOKENS
+
+# Longest emotion label, used to reserve room before the label is known
+EMOTION_PLACEHOLDER = "surprise"
+
+# Token caps for each character field, in priority order
+FIELD_TOKEN_LIMITS = {
+    'personality': 400,
+    'description': 400,
+    'speech_style': 200
+}
+
+class TokenizedText(str):
+    """A prompt segment that already carries its token IDs.
+
+    PromptBuilder attaches the IDs it counted, and stored replies keep the
+    tokens they were generated as, so the model does not tokenize them again.
+    `special_tokens` marks IDs that include BOS, for the first segment.
+    """
+
+    def __new__(cls, text, token_ids, special_tokens=False):
+        segment = super().__new__(cls, text)
+        segment.token_ids = tuple(token_ids)
+        segment.special_tokens = special_tokens
+        return segment
+
+def tokenize_segment(tokenizer, text, first=False):
+    """Token IDs of one prompt segment as it tokenizes inside the whole prompt.
+
+    Every segment after the first follows a newline. On its own a segment
+    would start with SentencePiece's word-start marker, so it is tokenized
+    after a newline whose tokens are then dropped. The first segment gets BOS.
+    """
+    if first:
+        return tuple(tokenizer(text, add_special_tokens=True)["input_ids"])
+    anchor = tokenizer("\n", add_special_tokens=False)["input_ids"]
+    ids = tokenizer("\n" + text, add_special_tokens=False)["input_ids"]
+    if ids[:len(anchor)] != anchor:
+        # The newline merged with the text, so there is no clean cut
+        return tuple(tokenizer(text, add_special_tokens=False)["input_ids"])
+    return tuple(ids[len(anchor):])
+
+def _system_block(character_name, description, personality, speech_style):
     # Pygmalion-2 uses a different format
-    prompt = f"""<|system|>You are {character_name}. Stay in character at all times.
-Background: {character_data.get('description', '')}
-Personality: {character_data.get('personality', '')}
-Speech Style: {character_data.get('speech_style', '')}
-User's emotion: {emotion}</s>
+    return f"""<|system|>You are {character_name}. Stay in character at all times.
+Background: {description}
+Personality: {personality}
+Speech Style: {speech_style}</s>
 """
-    
+
+def _summary_block(summary):
+    # Separate from the system block so the persona prefix stays cacheable
+    return f"<|system|>Earlier in this conversation: {summary}</s>\n"
+
+def _memory_block(snippets):
+    # Goes in front of the user turn, after the cacheable persona and history
+    details = "\n".join(f"- {snippet}" for snippet in snippets)
+    return f"<|system|>Relevant details:\n{details}</s>\n"
+
+def create_summary_prompt(character_name, summary, turns, max_words=120):
+    """Prompt asking the model to fold `turns` into the running summary"""
+    exchanges = "\n".join(f"User: {turn['user']}\n{character_name}: {turn['bot']}" for turn in turns)
+    previous = f"Summary so far: {summary}\n\n" if summary else ""
+    return (
+        f"<|system|>Summarize the roleplay between User and {character_name} in at most "
+        f"{max_words} words. Keep names, facts, promises and events that may matter later.</s>\n"
+        f"<|user|>{previous}New exchanges:\n{exchanges}</s>\n<|model|>"
+    )
+
+def _user_turn(user_input, emotion):
+    # The emotion goes right before the user turn so the persona and history
+    # prefix stays identical whatever the classifier says
+    return f"<|system|>User's emotion: {emotion}</s>\n<|user|>{user_input}</s>\n<|model|>"
+
+def create_prompt_segments(character_data, user_input, emotion, history_turns=()):
+    """Build the prompt as segments: system block, one per history turn, user turn.
+
+    Keeping the pieces separate lets the model tokenize them independently so
+    the persona and committed history map to stable, cacheable token prefixes.
+    """
+    character_name = character_data.get('name', 'Character')
+
+    segments = [_system_block(
+        character_name,
+        character_data.get('description', ''),
+        character_data.get('personality', ''),
+        character_data.get('speech_style', '')
+    )]
+
     # Add conversation history
-    if history_text:
-        prompt += history_text + "\n"
-    
+    segments.extend(turn + "\n" for turn in history_turns)
+
     # Add current interaction
-    prompt += f"<|user|>{user_input}</s>\n<|model|>"
-    
+    segments.append(_user_turn(user_input, emotion))
+
     # Shorten prompt if too long
     max_length = 2000
-    if len(prompt) > max_length:
+    if sum(len(segment) for segment in segments) > max_length:
         # Prioritize keeping personality and recent history
         personality = character_data.get('personality', '')[:500]
         description = character_data.get('description', '')[:500]
         speech_style = character_data.get('speech_style', '')[:300]
-        history = history_text[-800:]
-        
-        prompt = f"""<|system|>You are {character_name}. Stay in character.
+        history = "\n".join(history_turns)[-800:]
+
+        segments = [f"""<|system|>You are {character_name}. Stay in character.
 Personality: {personality}
 Background: {description}
-Speech Style: {speech_style}
-User's emotion: {emotion}</s>
-"""
+Speech Style: {speech_style}</s>
+"""]
         if history:
-            prompt += history + "\n"
-        prompt += f"<|user|>{user_input}</s>\n<|model|>"
-    
-    return prompt
\ No newline at end of file
+            segments.append(history + "\n")
+        segments.append(_user_turn(user_input, emotion))
+
+    return segments
+
+def create_character_prompt(character_data, user_input, emotion, history_text=""):
+    history_turns = [history_text] if history_text else []
+    return "".join(create_prompt_segments(character_data, user_input, emotion, history_turns))
+
+
+class PromptBuilder:
+    """Assemble prompt segments against a token budget.
+
+    Token counts are cached per character field and per history turn, so a
+    new turn only tokenizes text that has not been seen before. Every segment
+    is returned as TokenizedText carrying the IDs it was counted with, which
+    RoleplayModel.encode uses as-is. Persona fields
+    are cut at token boundaries and the oldest history turns are dropped first
+    once the context budget is used up.
+    """
+
+    def __init__(self, tokenizer, context_tokens=CONTEXT_TOKENS, reserve_tokens=MAX_RESPONSE_LENGTH,
+                 field_limits=FIELD_TOKEN_LIMITS, summary_tokens=SUMMARY_TOKENS, memory_tokens=MEMORY_TOKENS):
+        self.tokenizer = tokenizer
+        self.budget = context_tokens - reserve_tokens
+        self.field_limits = field_limits
+        self.summary_tokens = summary_tokens
+        self.memory_tokens = memory_tokens
+        self.token_ids = lru_cache(maxsize=8192)(self._tokenize)
+        self.truncate = lru_cache(maxsize=1024)(self._truncate)
+
+    def _tokenize(self, text, first=False):
+        return tokenize_segment(self.tokenizer, text, first)
+
+    def count(self, text):
+        ids = getattr(text, 'token_ids', None)
+        return len(ids) if ids is not None else len(self.token_ids(text))
+
+    def tokenized(self, text, first=False):
+        """text with the token IDs the model would give it; `first` adds BOS"""
+        return TokenizedText(text, self.token_ids(text, first), first)
+
+    def history_segment(self, turn, character_name):
+        """Format one stored turn, reusing the reply's generated token IDs if known"""
+        if not turn.get('bot_tokens'):
+            return self.tokenized(f"User: {turn['user']}\n{character_name}: {turn['bot']}\n")
+        bot_tokens = tuple(turn['bot_tokens'])
+        # A reply usually starts with a word-start token that carries the
+        # space after the name; the header only supplies it otherwise
+        spaced = self.tokenizer.decode(self.token_ids("a") + bot_tokens[:1]).startswith("a ")
+        header = f"User: {turn['user']}\n{character_name}:" + ("" if spaced else " ")
+        text = f"User: {turn['user']}\n{character_name}: {turn['bot'].lstrip()}\n"
+        # Tokenize the newline in context so no word-start marker is added
+        newline = self.token_ids("a\n")[len(self.token_ids("a")):]
+        return TokenizedText(text, self.token_ids(header) + bot_tokens + newline)
+
+    def _truncate(self, text, limit):
+        ids = self.token_ids(text)
+        if len(ids) <= limit:
+            return text
+        return self.tokenizer.decode(ids[:limit], skip_special_tokens=True).rstrip()
+
+    def build(self, character_data, user_input, emotion, history=(), summary="", memory=()):
+        """Return (segments, stats) for a prompt that fits the token budget"""
+        context, stats = self.build_context(character_data, user_input, history, summary, memory)
+        return self.add_user_turn(context, stats, user_input, emotion)
+
+    def add_user_turn(self, context, stats, user_input, emotion):
+        """Append retrieved details, the emotion line and user turn to segments from build_context"""
+        user_segment = self.tokenized(stats.get("memory_block", "") + _user_turn(user_input, emotion))
+        stats = dict(stats, prompt_tokens=stats["prompt_tokens"] + self.count(user_segment))
+        return context + [user_segment], stats
+
+    def build_context(self, character_data, user_input, history=(), summary="", memory=()):
+        """Return the persona, summary and history segments, which do not depend on emotion.
+
+        `history` is a list of stored turns ({'user', 'bot', 'bot_tokens'}),
+        `summary` the running summary of older turns and `memory` retrieved
+        snippets, best first. The budget reserves room for the user turn and
+        the snippets that fit, which add_user_turn places before the user
+        turn once the emotion label is known.
+        """
+        character_name = character_data.get('name', 'Character')
+        history_turns = [self.history_segment(turn, character_name) for turn in history]
+
+        # Template with BOS, emotion line and user turn are never dropped
+        fixed = (len(self.token_ids(_system_block(character_name, '', '', ''), True))
+                 + self.count(_user_turn(user_input, EMOTION_PLACEHOLDER)))
+        available = max(self.budget - fixed, 0)
+
+        # Persona fields get their caps, scaled down to half the budget if it is
+        # tight so recent history still fits
+        fields = {key: character_data.get(key, '') or '' for key in self.field_limits}
+        wanted = {key: min(self.count(fields[key]), limit) for key, limit in self.field_limits.items()}
+        total_wanted = sum(wanted.values())
+        if total_wanted > available // 2:
+            scale = (available // 2) / total_wanted
+            wanted = {key: int(n * scale) for key, n in wanted.items()}
+        for key, limit in wanted.items():
+            fields[key] = self.truncate(fields[key], limit) if limit else ''
+        available -= sum(wanted.values())
+        system_block = self.tokenized(_system_block(
+            character_name,
+            fields['description'],
+            fields['personality'],
+            fields['speech_style']
+        ), first=True)
+
+        # Retrieved snippets the persona does not already contain, dropping
+        # the lowest ranked ones until the rest fit
+        snippets = [snippet for snippet in memory if snippet not in system_block]
+        memory_block = ""
+        while snippets:
+            memory_block = _memory_block(snippets)
+            cost = self.count(memory_block)
+            if cost <= min(self.memory_tokens, available):
+                available -= cost
+                break
+            snippets.pop()
+            memory_block = ""
+
+        summary_segment = None
+        if summary:
+            summary = self.truncate(summary, self.summary_tokens)
+            summary_segment = self.tokenized(_summary_block(summary))
+            cost = self.count(summary_segment)
+            if cost <= available:
+                available -= cost
+            else:
+                summary_segment = None
+
+        # Keep the newest history turns that still fit
+        kept = []
+        for turn in reversed(history_turns):
+            cost = self.count(turn)
+            if cost > available:
+                break
+            kept.append(turn)
+            available -= cost
+        kept.reverse()
+
+        segments = [system_block]
+        if summary_segment:
+            segments.append(summary_segment)
+        segments.extend(kept)
+
+        stats = {
+            "prompt_tokens": sum(self.count(segment) for segment in segments),
+            "history_turns": len(kept),
+            "dropped_turns": len(history_turns) - len(kept),
+            "memory_snippets": len(snippets),
+            "memory_block": memory_block
+        }
+        return segments, stats
@@ -1,10 +1,14 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import re
 import logging
-from urllib.parse import urljoin
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import urljoin, urlsplit
 import json
 import time
+from config import ENRICH_DEADLINE, ENRICH_WORKERS, SCRAPER_PARSER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,32 +25,247 @@ HEADERS = {
     'Cache-Control': 'max-age=0'
 }
 
+# Enrichment sources; benchmarks point these at locally served fixtures
+WIKIPEDIA_API = "https://en.wikipedia.org/w/api.php"
+QUOTES_API = "https://quotefancy.com/api/search"
+CHARACTER_WIKI = "https://characterprofile.fandom.com"
+
+class HostRateLimiter:
+    """Spaces out requests so no host gets more than `rate` per second.
+
+    Each caller reserves the next free slot for its host and sleeps until
+    it comes up, so concurrent callers are served in arrival order.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# Set by bulk imports; interactive requests are not throttled
+_rate_limiter = None
+
+def set_host_rate_limit(rate):
+    """Limit every scraper request, enrichment lookups included, to `rate` per second per host"""
+    global _rate_limiter
+    _rate_limiter = HostRateLimiter(rate) if rate else None
+
+class _ThrottledAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        limiter = _rate_limiter
+        if limiter is not None:
+            limiter.wait(urlsplit(request.url).netloc)
+        return super().send(request, **kwargs)
+
+# Keep-alive sessions, one per thread, so repeated fetches to the same host reuse connections
+_local = threading.local()
+
+def get_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = _ThrottledAdapter(pool_connections=8, pool_maxsize=8)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+# Shared pool for enrichment lookups
+_enrich_pool = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix="enrich")
+
+def make_soup(markup, parse_only=None):
+    """Parse markup with SCRAPER_PARSER, falling back to html.parser if it is not installed"""
+    global SCRAPER_PARSER
+    try:
+        return BeautifulSoup(markup, SCRAPER_PARSER, parse_only=parse_only)
+    except FeatureNotFound:
+        logger.warning(f"HTML parser '{SCRAPER_PARSER}' is not installed, using html.parser")
+        SCRAPER_PARSER = 'html.parser'
+        return BeautifulSoup(markup, SCRAPER_PARSER, parse_only=parse_only)
+
+# Only the result list of the search page is ever read, so nothing else is built
+_SEARCH_RESULTS = SoupStrainer(attrs={'class': 'unified-search__result__content'})
+
+_REFERENCES = re.compile(r'\[\d+\]')
+_TEMPLATES = re.compile(r'\{\{.*?\}\}')
+_TAGS = re.compile(r'<.*?>')
+_WHITESPACE = re.compile(r'\s+')
+
 def clean_text(text):
     """Clean and format text from wiki"""
-    text = re.sub(r'\[\d+\]', '', text)  # Remove references [1]
-    text = re.sub(r'\{\{.*?\}\}', '', text)  # Remove templates {{...}}
-    text = re.sub(r'<.*?>', '', text)  # Remove HTML tags
-    text = text.replace('\n', ' ').replace('\t', ' ')  # Replace newlines and tabs
-    text = re.sub(r'\s+', ' ', text).strip()  # Collapse multiple spaces
-    return text
-
-def extract_image_url(soup, base_url):
+    # Each pass is skipped when its marker cannot occur in the text
+    if '[' in text:
+        text = _REFERENCES.sub('', text)  # Remove references [1]
+    if '{{' in text:
+        text = _TEMPLATES.sub('', text)  # Remove templates {{...}}
+    if '<' in text:
+        text = _TAGS.sub('', text)  # Remove HTML tags
+    return _WHITESPACE.sub(' ', text).strip()  # Collapse newlines, tabs and spaces
+
+# Image sources in priority order: (selector, attribute, test on the tag)
+IMAGE_SELECTORS = [
+    ('.pi-image-thumbnail', 'src'),
+    ('.mw-parser-output img', 'src'),
+    ('meta[property="og:image"]', 'content'),
+    ('meta[name="twitter:image"]', 'content'),
+    ('.image img', 'src'),
+    ('.thumbimage', 'src'),
+    ('.character-image img', 'src'),
+    ('.infobox-image img', 'src')
+]
+
+QUOTE_SELECTORS = [
+    'blockquote',
+    '.quote',
+    'dl dd',
+    '.poem',
+    'div.quote',
+    '.quote-box',
+    '.citation',
+    '.dialogue'
+]
+
+SPEECH_KEYWORDS = [
+    'speech', 'dialogue', 'quotes', 'voice', 'talking',
+    'personality', 'character', 'traits', 'style', 'catchphrase'
+]
+
+PERSONALITY_KEYWORDS = [
+    'personality', 'character', 'traits', 'behavior',
+    'appearance', 'abilities', 'skills', 'background'
+]
+
+
+def _ancestor_classes(tag):
+    classes = set()
+    for parent in tag.parents:
+        classes.update(parent.get('class') or ())
+    return classes
+
+
+def _image_matches(tag, classes):
+    """Indexes into IMAGE_SELECTORS of the selectors matching tag"""
+    matches = []
+    if 'pi-image-thumbnail' in classes:
+        matches.append(0)
+    if tag.name == 'img':
+        above = _ancestor_classes(tag)
+        if 'mw-parser-output' in above:
+            matches.append(1)
+        if 'image' in above:
+            matches.append(4)
+        if 'character-image' in above:
+            matches.append(6)
+        if 'infobox-image' in above:
+            matches.append(7)
+    elif tag.name == 'meta':
+        if tag.get('property') == 'og:image':
+            matches.append(2)
+        if tag.get('name') == 'twitter:image':
+            matches.append(3)
+    if 'thumbimage' in classes:
+        matches.append(5)
+    return matches
+
+
+def _quote_matches(tag, classes):
+    """Indexes into QUOTE_SELECTORS of the selectors matching tag"""
+    matches = []
+    if tag.name == 'blockquote':
+        matches.append(0)
+    if 'quote' in classes:
+        matches.append(1)
+        if tag.name == 'div':
+            matches.append(4)
+    if tag.name == 'dd' and any(parent.name == 'dl' for parent in tag.parents):
+        matches.append(2)
+    if 'poem' in classes:
+        matches.append(3)
+    if 'quote-box' in classes:
+        matches.append(5)
+    if 'citation' in classes:
+        matches.append(6)
+    if 'dialogue' in classes:
+        matches.append(7)
+    return matches
+
+
+class PageIndex:
+    """Everything the extractors need from a parsed wiki page, found in one walk.
+
+    Titles, the article body, section headings, quote elements and image
+    candidates are collected in document order in a single pass over the
+    tree, instead of one find_all/select traversal per selector. Section
+    bodies are built on first use and cached.
+    """
+
+    def __init__(self, soup):
+        self.soup = soup
+        self.titles = {}
+        self.content = None
+        self.headings = []
+        self.quotes = [[] for _ in QUOTE_SELECTORS]
+        self.images = [None] * len(IMAGE_SELECTORS)
+        self.sections = {}
+        for tag in soup.find_all(True):
+            name = tag.name
+            classes = tag.get('class') or ()
+            if name == 'h1':
+                if 'page-header__title' in classes:
+                    self.titles.setdefault('page-header__title', tag)
+                if tag.get('id') == 'firstHeading':
+                    self.titles.setdefault('firstHeading', tag)
+                if 'page-title__text' in classes:
+                    self.titles.setdefault('page-title__text', tag)
+            elif name in ('h2', 'h3', 'h4'):
+                self.headings.append((tag, tag.text))
+            if self.content is None and name == 'div' and 'mw-parser-output' in classes:
+                self.content = tag
+            for i in _quote_matches(tag, classes):
+                self.quotes[i].append(tag)
+            if name in ('img', 'meta') or classes:
+                for i in _image_matches(tag, classes):
+                    if self.images[i] is None:
+                        self.images[i] = tag
+
+    def title(self):
+        for key in ('page-header__title', 'firstHeading', 'page-title__text'):
+            if key in self.titles:
+                return self.titles[key]
+        return None
+
+    def section(self, heading, stop_names):
+        """Paragraphs and list items between heading and the next stop heading"""
+        key = (id(heading), stop_names)
+        content = self.sections.get(key)
+        if content is None:
+            content = ""
+            next_node = heading.find_next_sibling()
+            while next_node and next_node.name not in stop_names:
+                if next_node.name == 'p':
+                    content += clean_text(next_node.text) + "\n"
+                elif next_node.name == 'ul':
+                    for li in next_node.find_all('li'):
+                        content += "- " + clean_text(li.text) + "\n"
+                next_node = next_node.find_next_sibling()
+            self.sections[key] = content
+        return content
+
+
+def extract_image_url(soup, base_url, page=None):
     """Extract character image URL from the wiki page"""
     try:
+        page = page or PageIndex(soup)
         # Try various methods to find character image
-        sources = [
-            ('.pi-image-thumbnail', 'src'),
-            ('.mw-parser-output img', 'src'),
-            ('meta[property="og:image"]', 'content'),
-            ('meta[name="twitter:image"]', 'content'),
-            ('.image img', 'src'),
-            ('.thumbimage', 'src'),
-            ('.character-image img', 'src'),
-            ('.infobox-image img', 'src')
-        ]
-        
-        for selector, attr in sources:
-            element = soup.select_one(selector)
+        for (selector, attr), element in zip(IMAGE_SELECTORS, page.images):
             if element and element.get(attr):
                 img_url = element[attr]
                 # Handle relative URLs
@@ -59,31 +278,15 @@ def extract_image_url(soup, base_url):
         logger.error(f"Error extracting image: {e}")
     return None
 
-def extract_speech_style(soup):
+def extract_speech_style(soup, page=None):
     """Extract character speech patterns from the page"""
+    page = page or PageIndex(soup)
     speech_style = ""
     
-    # Look for specific sections
-    section_keywords = [
-        'speech', 'dialogue', 'quotes', 'voice', 'talking', 
-        'personality', 'character', 'traits', 'style', 'catchphrase'
-    ]
-    
     # Look for quotes in the page
     quotes = []
-    quote_selectors = [
-        'blockquote',
-        '.quote',
-        'dl dd',
-        '.poem',
-        'div.quote',
-        '.quote-box',
-        '.citation',
-        '.dialogue'
-    ]
-    
-    for selector in quote_selectors:
-        for element in soup.select(selector):
+    for elements in page.quotes:
+        for element in elements:
             text = clean_text(element.get_text())
             if len(text) > 10 and len(text) < 500:
                 quotes.append(text)
@@ -95,134 +298,222 @@ def extract_speech_style(soup):
         return speech_style
     
     # If no quotes, look for personality sections
-    for heading in soup.find_all(['h2', 'h3', 'h4']):
-        heading_text = heading.text.lower()
-        if any(kw in heading_text for kw in section_keywords):
-            content = ""
-            next_node = heading.find_next_sibling()
-            
-            while next_node and next_node.name not in ['h2', 'h3', 'h4']:
-                if next_node.name == 'p':
-                    content += clean_text(next_node.text) + "\n"
-                elif next_node.name == 'ul':
-                    for li in next_node.find_all('li'):
-                        content += "- " + clean_text(li.text) + "\n"
-                next_node = next_node.find_next_sibling()
-            
+    for heading, heading_text in page.headings:
+        if any(kw in heading_text.lower() for kw in SPEECH_KEYWORDS):
+            content = page.section(heading, ('h2', 'h3', 'h4'))
             if content:
                 return content[:1000]  # Return first 1000 characters
     
     return ""
 
-def extract_personality(soup):
+def extract_personality(soup, page=None):
     """Extract detailed personality information"""
+    page = page or PageIndex(soup)
     personality = ""
-    personality_keywords = [
-        'personality', 'character', 'traits', 'behavior',
-        'appearance', 'abilities', 'skills', 'background'
-    ]
     
     # Try to find personality section
-    for heading in soup.find_all(['h2', 'h3']):
-        heading_text = heading.text.lower()
-        if any(kw in heading_text for kw in personality_keywords):
-            content = ""
-            next_node = heading.find_next_sibling()
-            
-            while next_node and next_node.name not in ['h2', 'h3']:
-                if next_node.name == 'p':
-                    content += clean_text(next_node.text) + "\n"
-                elif next_node.name == 'ul':
-                    for li in next_node.find_all('li'):
-                        content += "- " + clean_text(li.text) + "\n"
-                next_node = next_node.find_next_sibling()
-            
+    for heading, heading_text in page.headings:
+        if heading.name == 'h4':
+            continue
+        if any(kw in heading_text.lower() for kw in PERSONALITY_KEYWORDS):
+            content = page.section(heading, ('h2', 'h3'))
             if content:
-                personality += f"## {heading.text}\n{content}\n"
+                personality += f"## {heading_text}\n{content}\n"
     
     return personality.strip()
 
+def failed_character_data(url):
+    return {
+        'name': "Character",
+        'description': "Failed to load character data",
+        'personality': "",
+        'speech_style': "",
+        'image_url': "",
+        'source_url': url
+    }
+
 def scrape_character_data(url):
     """Scrape character data from a wiki URL"""
     try:
         logger.info(f"Scraping character data from: {url}")
-        response = requests.get(url, headers=HEADERS, timeout=10)
+        response = get_session().get(url, headers=HEADERS, timeout=10)
         response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract character name
-        name_element = soup.find('h1', {'class': 'page-header__title'})
-        if not name_element:
-            name_element = soup.find('h1', {'id': 'firstHeading'})
-        if not name_element:
-            name_element = soup.find('h1', {'class': 'page-title__text'})
-        
-        name = name_element.text.strip() if name_element else "Character"
-        logger.info(f"Character name: {name}")
-        
-        # Extract description
-        description = ""
-        content = soup.find('div', {'class': 'mw-parser-output'})
-        if content:
-            # Get first 3 paragraphs
-            paragraphs = content.find_all('p', recursive=False)
-            valid_paragraphs = []
-            for p in paragraphs:
-                text = clean_text(p.text)
-                if text and len(text) > 50:
-                    valid_paragraphs.append(text)
-                if len(valid_paragraphs) >= 3:
-                    break
-            description = '\n'.join(valid_paragraphs)
-            
-            # If not enough content, try alternative approach
-            if len(description) < 100:
-                sections = content.find_all(['p', 'h2', 'h3'])
-                current_section = ""
-                for element in sections:
-                    if element.name == 'p':
-                        current_section += clean_text(element.text) + "\n"
-                    elif element.name in ['h2', 'h3']:
-                        if len(current_section) > 100:
-                            description = current_section
-                            break
-                        current_section = ""
-        
-        # Extract personality
-        personality = extract_personality(soup)
-        if not personality and description:
-            personality = description[:1000]
-        
-        # Extract speech style
-        speech_style = extract_speech_style(soup)
-        
-        # Extract image URL
-        image_url = extract_image_url(soup, url)
-        logger.info(f"Image URL found: {image_url}")
-        
-        return {
-            'name': name,
-            'description': description,
-            'personality': personality,
-            'speech_style': speech_style,
-            'image_url': image_url,
-            'source_url': url
-        }
+        return parse_character_page(response.content, url)
+    except Exception as e:
+        logger.error(f"Error scraping character data: {e}")
+        return failed_character_data(url)
+
+def load_character_profile(url, cache, deadline=ENRICH_DEADLINE, revalidate=False):
+    """Return an enhanced character profile, served from the profile cache when possible.
+
+    With `revalidate`, even a fresh entry is checked against the wiki first.
+    """
+    entry = cache.get(url)
+    if entry and cache.is_fresh(entry) and not revalidate:
+        logger.info(f"Using cached profile for: {url}")
+        return dict(entry['profile'])
+    
+    # Revalidate a stale entry with a conditional request. A partial entry is
+    # fetched in full instead: its enrichment has to run again either way
+    headers = dict(HEADERS)
+    if entry and not entry.get('partial'):
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
     
+    try:
+        logger.info(f"Scraping character data from: {url}")
+        response = get_session().get(url, headers=headers, timeout=10)
+        if response.status_code == 304 and entry and not entry.get('partial'):
+            logger.info(f"Cached profile still valid for: {url}")
+            return dict(cache.touch(entry)['profile'])
+        response.raise_for_status()
+        character_data = parse_character_page(response.content, url)
     except Exception as e:
         logger.error(f"Error scraping character data: {e}")
-        return {
-            'name': "Character",
-            'description': "Failed to load character data",
-            'personality': "",
-            'speech_style': "",
-            'image_url': "",
-            'source_url': url
-        }
-
-def enhance_character_data(character_data):
-    """Enhance character data with additional sources"""
+        if entry:
+            logger.info(f"Serving stale cached profile for: {url}")
+            return dict(entry['profile'])
+        return failed_character_data(url)
+    
+    missing = []
+    profile = enhance_character_data(character_data, deadline, missing)
+    if missing:
+        logger.info(f"Caching partial profile for {url} (missing: {', '.join(missing)})")
+    cache.put(
+        url,
+        profile,
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified'),
+        partial=bool(missing)
+    )
+    return dict(profile)
+
+def parse_character_page(html, url):
+    """Extract character data from a wiki page's HTML"""
+    soup = make_soup(html)
+    page = PageIndex(soup)
+    
+    # Extract character name
+    name_element = page.title()
+    
+    name = name_element.text.strip() if name_element else "Character"
+    logger.info(f"Character name: {name}")
+    
+    # Extract description
+    description = ""
+    content = page.content
+    if content:
+        # Get first 3 paragraphs
+        paragraphs = content.find_all('p', recursive=False)
+        valid_paragraphs = []
+        for p in paragraphs:
+            text = clean_text(p.text)
+            if text and len(text) > 50:
+                valid_paragraphs.append(text)
+            if len(valid_paragraphs) >= 3:
+                break
+        description = '\n'.join(valid_paragraphs)
+        
+        # If not enough content, try alternative approach
+        if len(description) < 100:
+            sections = content.find_all(['p', 'h2', 'h3'])
+            current_section = ""
+            for element in sections:
+                if element.name == 'p':
+                    current_section += clean_text(element.text) + "\n"
+                elif element.name in ['h2', 'h3']:
+                    if len(current_section) > 100:
+                        description = current_section
+                        break
+                    current_section = ""
+    
+    # Extract personality
+    personality = extract_personality(soup, page)
+    if not personality and description:
+        personality = description[:1000]
+    
+    # Extract speech style
+    speech_style = extract_speech_style(soup, page)
+    
+    # Extract image URL
+    image_url = extract_image_url(soup, url, page)
+    logger.info(f"Image URL found: {image_url}")
+    
+    return {
+        'name': name,
+        'description': description,
+        'personality': personality,
+        'speech_style': speech_style,
+        'image_url': image_url,
+        'source_url': url
+    }
+
+def fetch_wikipedia(name):
+    """Intro extract and thumbnail from Wikipedia"""
+    wikipedia_url = f"{WIKIPEDIA_API}?action=query&format=json&prop=extracts|pageimages&exintro&explaintext&titles={name}"
+    response = get_session().get(wikipedia_url, timeout=5)
+    data = response.json()
+    
+    # Extract Wikipedia data
+    pages = data.get('query', {}).get('pages', {})
+    for page in pages.values():
+        if 'extract' in page:
+            return page
+    return None
+
+def fetch_quotes(name):
+    """Quotes from QuoteFancy"""
+    quote_url = f"{QUOTES_API}?query={name}&page=1"
+    response = get_session().get(quote_url, timeout=5)
+    quotes_data = response.json()
+    return quotes_data.get('quotes') or []
+
+def fetch_character_wiki(name):
+    """Personality section and image from the Character Profile wiki"""
+    session = get_session()
+    search_url = f"{CHARACTER_WIKI}/wiki/Special:Search?query={name}"
+    response = session.get(search_url, headers=HEADERS, timeout=5)
+    soup = make_soup(response.content, _SEARCH_RESULTS)
+    
+    # Find first result
+    result = soup.select_one('.unified-search__result__content')
+    if not result:
+        return None
+    result_url = result.find('a')['href']
+    logger.info(f"Found character profile at: {result_url}")
+    
+    # Scrape the character profile
+    profile_response = session.get(result_url, headers=HEADERS, timeout=5)
+    profile_soup = make_soup(profile_response.content)
+    
+    # Extract personality
+    personality_content = ""
+    personality_section = profile_soup.select_one('#Personality')
+    if personality_section:
+        next_node = personality_section.find_next_sibling()
+        while next_node and next_node.name != 'h2':
+            if next_node.name == 'p':
+                personality_content += clean_text(next_node.text) + "\n"
+            elif next_node.name == 'ul':
+                for li in next_node.find_all('li'):
+                    personality_content += "- " + clean_text(li.text) + "\n"
+            next_node = next_node.find_next_sibling()
+    
+    image = profile_soup.select_one('.pi-image-thumbnail')
+    return {
+        'personality': personality_content,
+        'image_url': image['src'] if image else None
+    }
+
+def enhance_character_data(character_data, deadline=ENRICH_DEADLINE, missing=None):
+    """Enhance character data with additional sources.
+
+    The lookups run concurrently and share one overall deadline; whatever has
+    arrived by then is merged and slower sources are ignored. Sources that
+    failed or missed the deadline are appended to `missing` when given.
+    """
     name = character_data['name']
     
     # Skip enhancement if we already have good data
@@ -231,84 +522,58 @@ def enhance_character_data(character_data):
     
     logger.info(f"Enhancing character data for: {name}")
     
-    # Try to get character data from Wikipedia
+    lookups = {'wikipedia': fetch_wikipedia}
+    if not character_data['speech_style']:
+        lookups['quotes'] = fetch_quotes
+    if len(character_data['personality']) < 500:
+        lookups['character_wiki'] = fetch_character_wiki
+    
+    futures = {_enrich_pool.submit(fetch, name): source for source, fetch in lookups.items()}
+    results = {}
     try:
-        wikipedia_url = f"https://en.wikipedia.org/w/api.php?action=query&format=json&prop=extracts|pageimages&exintro&explaintext&titles={name}"
-        response = requests.get(wikipedia_url, timeout=5)
-        data = response.json()
+        for future in as_completed(futures, timeout=deadline):
+            source = futures[future]
+            try:
+                results[source] = future.result()
+            except Exception as e:
+                logger.error(f"{source} enhancement failed: {e}")
+                if missing is not None:
+                    missing.append(source)
+    except FuturesTimeout:
+        pending = [source for future, source in futures.items() if not future.done()]
+        logger.warning(f"Enhancement deadline reached, skipping: {', '.join(pending)}")
+        if missing is not None:
+            missing.extend(pending)
+    
+    # Merge in priority order so the result does not depend on arrival order
+    page = results.get('wikipedia')
+    if page:
+        # Add to description if we don't have enough
+        if len(character_data['description']) < 300:
+            character_data['description'] += "\n\n" + page['extract'][:500]
         
-        # Extract Wikipedia data
-        pages = data.get('query', {}).get('pages', {})
-        for page in pages.values():
-            if 'extract' in page:
-                # Add to description if we don't have enough
-                if len(character_data['description']) < 300:
-                    character_data['description'] += "\n\n" + page['extract'][:500]
-                
-                # Get image from Wikipedia if not found
-                if not character_data['image_url'] and 'thumbnail' in page:
-                    character_data['image_url'] = page['thumbnail']['source']
-                    logger.info(f"Added Wikipedia image: {character_data['image_url']}")
-    except Exception as e:
-        logger.error(f"Wikipedia enhancement failed: {e}")
+        # Get image from Wikipedia if not found
+        if not character_data['image_url'] and 'thumbnail' in page:
+            character_data['image_url'] = page['thumbnail']['source']
+            logger.info(f"Added Wikipedia image: {character_data['image_url']}")
     
-    # Try to get quotes from QuoteFancy
-    try:
-        if not character_data['speech_style']:
-            quote_url = f"https://quotefancy.com/api/search?query={name}&page=1"
-            response = requests.get(quote_url, timeout=5)
-            quotes_data = response.json()
-            
-            if quotes_data.get('quotes'):
-                character_data['speech_style'] = "Character is known for quotes like:\n"
-                for quote in quotes_data['quotes'][:3]:
-                    character_data['speech_style'] += f"- {quote['content']}\n"
-                logger.info("Added quotes from QuoteFancy")
-    except Exception as e:
-        logger.error(f"Quote enhancement failed: {e}")
+    quotes = results.get('quotes')
+    if quotes:
+        character_data['speech_style'] = "Character is known for quotes like:\n"
+        for quote in quotes[:3]:
+            character_data['speech_style'] += f"- {quote['content']}\n"
+        logger.info("Added quotes from QuoteFancy")
     
-    # Try to get data from Character Wiki
-    try:
-        if len(character_data['personality']) < 500:
-            search_url = f"https://characterprofile.fandom.com/wiki/Special:Search?query={name}"
-            response = requests.get(search_url, headers=HEADERS, timeout=5)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Find first result
-            result = soup.select_one('.unified-search__result__content')
-            if result:
-                result_url = result.find('a')['href']
-                logger.info(f"Found character profile at: {result_url}")
-                
-                # Scrape the character profile
-                profile_response = requests.get(result_url, headers=HEADERS, timeout=5)
-                profile_soup = BeautifulSoup(profile_response.content, 'html.parser')
-                
-                # Extract personality
-                personality_section = profile_soup.select_one('#Personality')
-                if personality_section:
-                    personality_content = ""
-                    next_node = personality_section.find_next_sibling()
-                    while next_node and next_node.name != 'h2':
-                        if next_node.name == 'p':
-                            personality_content += clean_text(next_node.text) + "\n"
-                        elif next_node.name == 'ul':
-                            for li in next_node.find_all('li'):
-                                personality_content += "- " + clean_text(li.text) + "\n"
-                        next_node = next_node.find_next_sibling()
-                    
-                    if personality_content:
-                        character_data['personality'] += "\n\n" + personality_content
-                        logger.info("Added personality from Character Wiki")
-                
-                # Extract image if missing
-                if not character_data['image_url']:
-                    image = profile_soup.select_one('.pi-image-thumbnail')
-                    if image:
-                        character_data['image_url'] = image['src']
-                        logger.info(f"Added image from Character Wiki: {character_data['image_url']}")
-    except Exception as e:
-        logger.error(f"Character Wiki enhancement failed: {e}")
+    profile = results.get('character_wiki')
+    if profile:
+        if profile['personality']:
+            character_data['personality'] += "\n\n" + profile['personality']
+            logger.info("Added personality from Character Wiki")
+        
+        # Extract image if missing
+        if not character_data['image_url'] and profile['image_url']:
+            character_data['image_url'] = profile['image_url']
+            logger.info(f"Added image from Character Wiki: {character_data['image_url']}")
     
     # Final fallbacks
     if not character_data['image_url']:
@@ -317,4 +582,4 @@ def enhance_character_data(character_data):
     if not character_data['speech_style']:
         character_data['speech_style'] = "No specific speech style information available"
     
-    return character_data
\ No newline at end of file
+    return character_data
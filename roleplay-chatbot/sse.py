@@ -0,0 +1,182 @@
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from threading import Lock, Timer
+from config import SSE_FLUSH_MS, SSE_FLUSH_BYTES, SSE_HEARTBEAT, SSE_RESUME_GRACE
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_MS = 1000  # Delay before the browser reconnects a dropped stream
+MAX_STREAMS = 256  # Recent replies kept for clients to resume
+STORE_POLL = 0.25  # Seconds between store reads when following another worker's reply
+STORE_FOLLOW_TIMEOUT = 120  # Longest a reply streaming in another worker is followed
+
+
+def format_event(text, event_id=None, event=None):
+    """One SSE event; each line of text becomes its own data field"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if event_id:
+        lines.append(f"id: {event_id}")
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class ReplyStream:
+    """A streamed reply that a client can drop and pick up again from an offset.
+
+    Tokens are coalesced into frames: a frame goes out `flush_interval`
+    seconds after its first token or once `flush_bytes` of text is waiting,
+    whichever comes first. Every frame's event ID is the stream ID plus the
+    reply offset it ends at, so a reconnecting EventSource (which sends the
+    last ID as Last-Event-ID) is replayed exactly what it missed. With no
+    client attached the generation keeps going for `grace` seconds before it
+    is cancelled, and `on_finish` runs once the reply is over either way.
+    """
+
+    def __init__(self, session_id, generation, on_finish, on_progress=None,
+                 flush_interval=SSE_FLUSH_MS / 1000, flush_bytes=SSE_FLUSH_BYTES,
+                 heartbeat=SSE_HEARTBEAT, grace=SSE_RESUME_GRACE):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.generation = generation
+        self.on_finish = on_finish
+        self.on_progress = on_progress
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.heartbeat = heartbeat
+        self.grace = grace
+        self.clients = 0
+        self.finished = False
+        self.timer = None
+        self.lock = Lock()
+        # A response that is never iterated must not leave the generation running
+        self._detach(0)
+
+    def _detach(self, clients):
+        with self.lock:
+            self.clients -= clients
+            if self.clients or self.finished:
+                return
+            self.timer = Timer(self.grace, self._abandon)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _attach(self):
+        with self.lock:
+            self.clients += 1
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def _abandon(self):
+        with self.lock:
+            if self.clients:
+                return
+        self.generation.cancel()
+        self.finish()
+
+    def finish(self):
+        """Run on_finish once the generation is over (at most once)"""
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.generation.finished.wait(timeout=5)
+        try:
+            self.on_finish()
+        except Exception as e:
+            logger.error(f"Error finishing reply stream {self.id}: {e}")
+
+    def events(self, offset=0):
+        """SSE text of the reply from `offset` on, ending with a "done" event"""
+        generation = self.generation
+        self._attach()
+        try:
+            # An ID before any text, so even a reconnect before the first
+            # frame resumes this reply rather than starting the turn again
+            yield f"retry: {RECONNECT_MS}\nid: {self.id}:{offset}\n\n"
+            while True:
+                if not generation.wait_for_text(offset, self.heartbeat):
+                    # Keep-alive comment; fails fast if the client is gone
+                    yield ": keep-alive\n\n"
+                    continue
+                # The first frame goes out at once; later ones wait for company
+                if offset:
+                    deadline = time.monotonic() + self.flush_interval
+                    while not generation.finished.is_set():
+                        remaining = deadline - time.monotonic()
+                        waiting = len(generation.text[offset:].encode('utf-8'))
+                        if remaining <= 0 or waiting >= self.flush_bytes:
+                            break
+                        generation.wait_for_text(len(generation.text), remaining)
+                text = generation.text[offset:]
+                if text:
+                    offset += len(text)
+                    yield format_event(text, f"{self.id}:{offset}")
+                    if self.on_progress is not None:
+                        self.on_progress()
+                if generation.finished.is_set() and offset >= len(generation.text):
+                    break
+            yield format_event("", event="done")
+            self.finish()
+        finally:
+            self._detach(1)
+
+
+def stored_reply_events(last_event_id, latest_reply, heartbeat=SSE_HEARTBEAT,
+                        poll=STORE_POLL, timeout=STORE_FOLLOW_TIMEOUT):
+    """SSE text of a reply whose stream is not in this process, read from the store.
+
+    With several worker processes a reconnect can land on a worker that does
+    not own the stream. `latest_reply()` returns the (text, finished) of the
+    session's newest turn as committed to the store, which is polled until
+    the turn is finished; text arrives in HISTORY_COMMIT_TOKENS steps, and a
+    reply whose owner cancelled it once its client left ends where it was cut.
+    """
+    stream_id, _, offset = last_event_id.partition(':')
+    offset = int(offset) if offset.isdigit() else 0
+    deadline = time.monotonic() + timeout
+    last_sent = time.monotonic()
+    yield f"retry: {RECONNECT_MS}\nid: {stream_id}:{offset}\n\n"
+    while True:
+        text, finished = latest_reply()
+        if len(text) > offset:
+            yield format_event(text[offset:], f"{stream_id}:{len(text)}")
+            offset = len(text)
+            last_sent = time.monotonic()
+        if finished or time.monotonic() > deadline:
+            break
+        if time.monotonic() - last_sent >= heartbeat:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(poll)
+    yield format_event("", event="done")
+
+
+class ReplyStreams:
+    """Recent reply streams by ID, for Last-Event-ID resumes"""
+
+    def __init__(self, max_size=MAX_STREAMS):
+        self.max_size = max_size
+        self.streams = OrderedDict()
+        self.lock = Lock()
+
+    def add(self, stream):
+        with self.lock:
+            self.streams[stream.id] = stream
+            while len(self.streams) > self.max_size:
+                self.streams.popitem(last=False)
+        return stream
+
+    def resume(self, last_event_id, session_id):
+        """(stream, offset) for a Last-Event-ID of this session, or (None, 0)"""
+        stream_id, _, offset = last_event_id.partition(':')
+        with self.lock:
+            stream = self.streams.get(stream_id)
+        if stream is None or stream.session_id != session_id or not offset.isdigit():
+            return None, 0
+        return stream, min(int(offset), len(stream.generation.text))
@@ -176,29 +176,30 @@ document.addEventListener('DOMContentLoaded', () => {
             // Use streaming
             const eventSource = new EventSource(`/chat?message=${encodeURIComponent(message)}`);
             let fullResponse = '';
-            let messageDiv = null;
+            let responseText = null;
             
             eventSource.onmessage = (event) => {
                 if (event.data) {
                     fullResponse += event.data;
                     
-                    if (!messageDiv) {
+                    if (!responseText) {
                         // Create message container for bot response
-                        messageDiv = document.createElement('div');
+                        const messageDiv = document.createElement('div');
                         messageDiv.classList.add('message', 'bot-message');
-                        messageDiv.innerHTML = `<strong>${window.characterName}:</strong> <span id="bot-response">${fullResponse}</span>`;
+                        messageDiv.innerHTML = `<strong>${window.characterName}:</strong> <span class="bot-response"></span>`;
+                        responseText = document.createTextNode('');
+                        messageDiv.querySelector('.bot-response').appendChild(responseText);
                         chatHistory.appendChild(messageDiv);
-                    } else {
-                        // Update existing response
-                        document.getElementById('bot-response').textContent = fullResponse;
                     }
+                    // Append only the new text instead of re-rendering the reply
+                    responseText.appendData(event.data);
                     
                     // Scroll to bottom
                     chatHistory.scrollTop = chatHistory.scrollHeight;
                 }
             };
             
-            eventSource.onerror = () => {
+            const finishResponse = () => {
                 eventSource.close();
                 typingIndicator.classList.remove('visible');
                 userInput.disabled = false;
@@ -214,6 +215,13 @@ document.addEventListener('DOMContentLoaded', () => {
                     sessionStorage.setItem('chat_history', JSON.stringify(history));
                 }
             };
+            
+            // A dropped connection is retried by the browser and resumed by the
+            // server from the last frame received; only a closed stream ends here
+            eventSource.addEventListener('done', () => finishResponse());
+            eventSource.onerror = () => {
+                if (eventSource.readyState === EventSource.CLOSED) finishResponse();
+            };
         } catch (error) {
             console.error('Error sending message:', error);
             addSystemMessage('Error communicating with server');
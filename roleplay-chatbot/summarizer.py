@@ -0,0 +1,67 @@
+import queue
+import logging
+from threading import Thread, Lock
+from prompts import create_summary_prompt
+from model_handler import ServerBusyError
+from config import SUMMARY_FOLD_TURNS, SUMMARY_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSummarizer:
+    """Folds turns that left the history window into a running summary.
+
+    Runs on a background thread so chat requests never wait for it. Turns are
+    folded in groups of `fold_turns` with one generation request, and the
+    summary is kept per session in the conversation store, so the prompt
+    carries a bounded summary plus a fixed window however long the
+    conversation gets.
+    """
+
+    def __init__(self, store, model, fold_turns=SUMMARY_FOLD_TURNS, max_tokens=SUMMARY_TOKENS):
+        self.store = store
+        self.model = model
+        self.fold_turns = fold_turns
+        self.max_tokens = max_tokens
+        self.pending = queue.Queue()
+        self.queued = set()
+        self.lock = Lock()
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def schedule(self, session_id):
+        """Queue a session for folding if it has enough unsummarized turns"""
+        if len(self.store.pending_summary(session_id)) < self.fold_turns:
+            return
+        with self.lock:
+            if session_id in self.queued:
+                return
+            self.queued.add(session_id)
+        self.pending.put(session_id)
+
+    def _run(self):
+        while True:
+            session_id = self.pending.get()
+            with self.lock:
+                self.queued.discard(session_id)
+            try:
+                self.fold(session_id)
+            except ServerBusyError:
+                # The turns stay pending and are retried after the next turn
+                logger.info(f"Model busy, postponing summary for session {session_id}")
+            except Exception as e:
+                logger.error(f"Error summarizing session {session_id}: {e}")
+
+    def fold(self, session_id):
+        turns = self.store.pending_summary(session_id)
+        if not turns:
+            return
+        character = self.store.get_character(session_id)
+        prompt = create_summary_prompt(
+            character.get('name', 'Character'),
+            self.store.get_summary(session_id),
+            turns
+        )
+        summary = self.model.submit(prompt, self.max_tokens).result().strip()
+        if summary and self.store.set_summary(session_id, summary, turns):
+            logger.info(f"Folded {len(turns)} turns into the summary for session {session_id}")
@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from tiny_model import build_sentencepiece_tokenizer  # noqa: E402
+from model_handler import RoleplayModel  # noqa: E402
+from prompts import PromptBuilder  # noqa: E402
+
+CHARACTER = {
+    'name': "Naruto",
+    'description': "A ninja from the Hidden Leaf Village who wants to become Hokage.",
+    'personality': "Loud, stubborn and loyal. Never gives up on his friends.",
+    'speech_style': "Ends sentences with 'believe it!'"
+}
+HISTORY = [
+    {'user': "Hello there!", 'bot': "Hey! I'm going to be Hokage, believe it!"},
+    {'user': "What do you eat?", 'bot': "Ramen at Ichiraku, every single day."}
+]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return build_sentencepiece_tokenizer()
+
+
+@pytest.fixture(scope="module")
+def model(tokenizer, tmp_path_factory):
+    model = RoleplayModel(str(tmp_path_factory.mktemp("model")), "transformers", load=False)
+    model.backend.tokenizer = tokenizer
+    return model
+
+
+def test_encode_matches_whole_prompt(model, tokenizer):
+    builder = PromptBuilder(tokenizer)
+    segments, stats = builder.build(
+        CHARACTER, "Tell me about the village.", "joy", HISTORY,
+        summary="They met at the academy.", memory=["Naruto carries a frog wallet."]
+    )
+    expected = tokenizer("".join(segments))["input_ids"]
+    assert model.encode(segments)[0] == expected
+    # Plain strings, as a remote client without token IDs would send them
+    assert model.encode([str(segment) for segment in segments])[0] == expected
+    assert stats["prompt_tokens"] == len(expected)
+
+
+def test_history_segment_ids_match_text(tokenizer):
+    builder = PromptBuilder(tokenizer)
+    # A reply as generated: its first token carries the word-start space
+    bot_tokens = tokenizer("Believe it!", add_special_tokens=False)["input_ids"]
+    turn = {'user': "Hello there!", 'bot': tokenizer.decode(bot_tokens), 'bot_tokens': bot_tokens}
+    segment = builder.history_segment(turn, "Naruto")
+    assert str(segment) == "User: Hello there!\nNaruto: Believe it!\n"
+    assert tokenizer.decode(segment.token_ids) == str(segment)
+    # Without a word-start token the header keeps its space
+    turn['bot_tokens'] = list(builder.token_ids("Believe it!"))
+    assert tokenizer.decode(builder.history_segment(turn, "Naruto").token_ids) == str(segment)
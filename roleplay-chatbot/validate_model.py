@@ -1,49 +1,73 @@
 import os
+import sys
+import time
+import argparse
 from transformers import AutoConfig
+from model_manifest import (
+    load_manifest, build_manifest, write_manifest, check_manifest, verify_manifest, MANIFEST_FILE
+)
+from model_handler import TransformersBackend
+from config import MODEL_PATH, MANIFEST_HASH_WORKERS
 
-model_path = "./models/pygmalion-2-7b"
-
-try:
-    print(f"Validating model at: {model_path}")
-    
-    # Check if directory exists
-    if not os.path.exists(model_path):
-        raise FileNotFoundError("Model directory not found")
-    
-    # Check for required files
-    required_files = [
-        "config.json", 
-        "tokenizer.json", 
-        "tokenizer.model",
-        "tokenizer_config.json"
-    ]
-    
-    for file in required_files:
-        path = os.path.join(model_path, file)
-        if not os.path.exists(path):
-            raise FileNotFoundError(f"Missing file: {file}")
-        print(f"Found: {file}")
-    
-    # Try to load config
-    config = AutoConfig.from_pretrained(model_path, local_files_only=True)
-    print("Config loaded successfully!")
-    print(f"Model type: {config.model_type}")
-    
-    # Check for model weights
-    weight_files = [
-        f for f in os.listdir(model_path) 
-        if f.endswith(".safetensors") or f.startswith("pytorch_model")
-    ]
-    
-    if not weight_files:
-        raise ValueError("No model weight files found")
-    
-    print("Found weight files:")
-    for file in weight_files:
-        print(f"- {file}")
-    
-    print("\nModel validation successful! You can now run app.py")
-    
-except Exception as e:
-    print(f"\nValidation failed: {e}")
-    print("Please check your model files and directory structure")
\ No newline at end of file
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the model files against their manifest")
+    parser.add_argument("model_path", nargs="?", default=MODEL_PATH)
+    parser.add_argument("--full", action="store_true", help="Also re-hash every file (reads the whole model)")
+    parser.add_argument("--workers", type=int, default=MANIFEST_HASH_WORKERS, help="Files hashed at once")
+    parser.add_argument("--write", action="store_true",
+                        help=f"Write {MANIFEST_FILE} from the files as they are now (for models copied by hand)")
+    args = parser.parse_args()
+    model_path = args.model_path
+
+    try:
+        print(f"Validating model at: {model_path}")
+
+        # Check if directory exists
+        if not os.path.exists(model_path):
+            raise FileNotFoundError("Model directory not found")
+
+        if args.write:
+            print(f"Hashing model files with {args.workers} workers...")
+            print(f"Wrote {write_manifest(model_path, build_manifest(model_path, workers=args.workers))}")
+
+        manifest = load_manifest(model_path)
+        if manifest is None:
+            raise FileNotFoundError(f"No {MANIFEST_FILE}; run download_model.py, or rerun with --write")
+
+        problems = check_manifest(model_path, manifest, TransformersBackend.required_files)
+        if not problems and args.full:
+            start_time = time.monotonic()
+            problems = verify_manifest(model_path, manifest, args.workers)
+            total = sum(entry["size"] for entry in manifest["files"].values())
+            elapsed = time.monotonic() - start_time
+            print(f"Hashed {len(manifest['files'])} files ({total / 1e9:.2f} GB) in {elapsed:.1f}s")
+        if problems:
+            raise ValueError("\n  " + "\n  ".join(problems))
+        print(f"All {len(manifest['files'])} files match {MANIFEST_FILE}"
+              + ("" if args.full else " by size (use --full to check hashes)"))
+
+        # Try to load config
+        config = AutoConfig.from_pretrained(model_path, local_files_only=True)
+        print("Config loaded successfully!")
+        print(f"Model type: {config.model_type}")
+
+        # Check for model weights
+        if not manifest["shards"]:
+            raise ValueError("No model weight files found")
+
+        print(f"Found {manifest['format']} weight files:")
+        for file in manifest["shards"]:
+            print(f"- {file}")
+
+        print("\nModel validation successful! You can now run app.py")
+        return 0
+
+    except Exception as e:
+        print(f"\nValidation failed: {e}")
+        print("Please check your model files and directory structure")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
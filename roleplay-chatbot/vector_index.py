@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock, get_ident
+import numpy as np
+from config import EMBEDDING_DIM, MEMORY_INDEX_DIR, MEMORY_TOP_K, STORE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+MIN_SCORE = 0.1  # Weaker matches are mostly hash collisions and shared filler words
+
+_WORD = re.compile(r"[a-z0-9']+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_STOPWORDS = frozenset(
+    "a about after all also am an and any are as at be been before but by can could did do does "
+    "for from had has have he her here him his how i if in into is it its just me more my no not "
+    "of on one or our out she so some than that the their them then there they this to too up us "
+    "very was we were what when where which who why will with would you your".split()
+)
+
+
+def chunk_text(text, max_words=50):
+    """Split lore into paragraph-aligned chunks of whole sentences"""
+    chunks = []
+    for paragraph in text.split("\n"):
+        current, words = [], 0
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            count = len(sentence.split())
+            if not count:
+                continue
+            if current and words + count > max_words:
+                chunks.append(" ".join(current))
+                current, words = [], 0
+            current.append(sentence)
+            words += count
+        if current:
+            chunks.append(" ".join(current))
+    return chunks
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs into a unit vector.
+
+    Needs no model download and costs microseconds per text, which is all
+    that is needed to match a message against lore mentioning the same
+    names, places and events. Features count once per text so a repeated
+    word cannot drown out the rest.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+            features = set(words)
+            features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+            for feature in features:
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+class VectorIndex:
+    """Unit vectors and their texts with cosine top-k search.
+
+    Rows live in one preallocated float32 matrix that doubles when full, so
+    a search is a single matrix-vector product over contiguous memory.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.data = np.zeros((16, dim), dtype=np.float32)
+        self.texts = []
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, texts, vectors):
+        with self.lock:
+            size = len(self.texts)
+            needed = size + len(texts)
+            if needed > len(self.data):
+                grown = np.zeros((max(needed, 2 * len(self.data)), self.dim), dtype=np.float32)
+                grown[:size] = self.data[:size]
+                self.data = grown
+            self.data[size:needed] = vectors
+            self.texts.extend(texts)
+
+    def search(self, vector, k=MEMORY_TOP_K):
+        """Return up to k (score, text) pairs scoring at least MIN_SCORE, best first"""
+        with self.lock:
+            size = len(self.texts)
+            if not size or k <= 0:
+                return []
+            scores = self.data[:size] @ vector
+            texts = self.texts
+        if k < size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), texts[i]) for i in top if scores[i] >= MIN_SCORE]
+
+    def save(self, path):
+        """Write the index as .npz (vectors plus JSON metadata), atomically"""
+        with self.lock:
+            vectors = self.data[:len(self.texts)].copy()
+            meta = json.dumps({"version": INDEX_VERSION, "dim": self.dim, "texts": self.texts})
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, vectors=vectors, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version: {meta.get('version')}")
+            index = cls(meta["dim"])
+            index.add(meta["texts"], data["vectors"])
+        return index
+
+
+class MemoryRetriever:
+    """Finds the lore chunks and past turns most relevant to a message.
+
+    Character profiles are chunked and indexed once, then kept on disk keyed
+    by a hash of their content, so every session using a character shares
+    one index. Each session also gets an in-memory index of its finished
+    turns, so details from turns long gone from the prompt can be recalled.
+    """
+
+    def __init__(self, directory=MEMORY_INDEX_DIR, embedder=None, max_sessions=STORE_CACHE_SIZE):
+        self.directory = directory
+        self.embedder = embedder or HashingEmbedder()
+        self.max_sessions = max_sessions
+        self.characters = OrderedDict()
+        self.digests = OrderedDict()  # id(character) -> (character, digest of its lore)
+        self.sessions = OrderedDict()
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _lore(character):
+        return "\n".join(character.get(key, '') or '' for key in ('description', 'personality', 'speech_style'))
+
+    def _digest(self, character):
+        # Stores hand out the same profile dict on every turn, so hashing its
+        # lore once per object keeps lookups off the per-turn path
+        with self.lock:
+            entry = self.digests.get(id(character))
+            if entry is not None and entry[0] is character:
+                return entry[1]
+        lore = self._lore(character)
+        digest = hashlib.sha1(f"{self.embedder.dim}:{lore}".encode('utf-8')).hexdigest()
+        with self.lock:
+            self.digests[id(character)] = (character, digest)
+            while len(self.digests) > self.max_sessions:
+                self.digests.popitem(last=False)
+        return digest
+
+    def character_index(self, character):
+        digest = self._digest(character)
+        with self.lock:
+            index = self.characters.get(digest)
+            if index is not None:
+                self.characters.move_to_end(digest)
+                return index
+        path = os.path.join(self.directory, digest + ".npz")
+        index = None
+        if os.path.exists(path):
+            try:
+                index = VectorIndex.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Could not load lore index {path}: {e}")
+        if index is None:
+            chunks = chunk_text(self._lore(character))
+            index = VectorIndex(self.embedder.dim)
+            if chunks:
+                index.add(chunks, self.embedder.embed(chunks))
+            try:
+                index.save(path)
+            except OSError as e:
+                logger.error(f"Could not write lore index {path}: {e}")
+        with self.lock:
+            self.characters[digest] = index
+            while len(self.characters) > self.max_sessions:
+                self.characters.popitem(last=False)
+        return index
+
+    def _session_index(self, session_id, create=True):
+        with self.lock:
+            index = self.sessions.get(session_id)
+            if index is None and create:
+                index = VectorIndex(self.embedder.dim)
+                self.sessions[session_id] = index
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            if index is not None:
+                self.sessions.move_to_end(session_id)
+            return index
+
+    @staticmethod
+    def turn_text(turn, character_name):
+        return f"User: {turn['user']}\n{character_name}: {turn['bot']}"
+
+    def add_turn(self, session_id, turn, character_name):
+        text = self.turn_text(turn, character_name)
+        self._session_index(session_id).add([text], self.embedder.embed([text]))
+
+    def forget(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def retrieve(self, character, session_id, query, exclude=(), k=MEMORY_TOP_K):
+        """Top-k lore chunks and past turns for query, best first, skipping `exclude`"""
+        vector = self.embedder.embed([query])[0]
+        exclude = set(exclude)
+        results = self.character_index(character).search(vector, k + len(exclude))
+        session_index = self._session_index(session_id, create=False)
+        if session_index is not None:
+            results += session_index.search(vector, k + len(exclude))
+        results.sort(key=lambda result: -result[0])
+        return [text for _, text in results if text not in exclude][:k]